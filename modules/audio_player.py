@@ -1,43 +1,133 @@
-import os
+import random
 import asyncio
 import discord
-import shutil
-from pathlib import Path    
+from collections import deque
+from itertools import islice, count
+from modules.track import Track, STREAM, FILE, MEMORY, RESOLVING, READY, FAILED, format_duration
 
 class AudioPlayer:
-    def __init__(self, server_id=None, text_channel=None): 
-        self.server_id = server_id      # optional for use in other servers
-        self.queue = []
+    def __init__(self, server_id=None, text_channel=None, on_idle=None, resolver=None, prefetch_depth=2, stream_volume=1.0, speech_volume=2.0, clip_cache=None): 
+        self.server_id = server_id      # guild id that owns this player
+        self.queue = deque()            # upcoming Track objects
         self.current_track = None
         self.is_playing = False
         self.is_paused = False
-        self.download_dir = "downloads"
         self.text_channel = text_channel
-    
-    async def play(self, ctx, source, title, is_stream=False, text_callback=None):
+        self.on_idle = on_idle          # called with server_id when queue runs dry
+
+        # async callable turning search term or url into (stream_url, title, duration)
+        self.resolver = resolver
+        # number of upcoming queue entries resolved in background while current track plays
+        self.prefetch_depth = prefetch_depth
+        # number of tracks/playlist pages being fetched for immediate play (keeps player from being released meanwhile)
+        self.pending_resolves = 0
+        # background tasks still paging playlists into queue
+        self.playlist_tasks = set()
+        # set while next queued track is being started (its audio may still be synthesizing/resolving)
+        self.advancing = False
+        # set when skip is requested while next track is still being started
+        self.skip_pending = False
+        self.advancing_track = None
+
+        # stream volume applied by ffmpeg, at 1.0 opus streams are passed through without decoding or re-encoding
+        self.stream_volume = stream_volume
+        # speech is re-encoded from mp3 anyway, so gain to bring it in line with music is applied there
+        self.speech_volume = speech_volume
+
+        # cached tts clips played from file are pinned until they finish or are dropped
+        self.clip_cache = clip_cache
+        # ids tying speech segments of one answer together
+        self.speech_groups = count(1)
+
+        # max queue entries listed by get_queue (keeps message under discord limit)
+        self.queue_display_limit = 15
+
+    async def enqueue(self, ctx, query):
+        """queue youtube track by search term or url, resolving it in the background"""
+        voice_client = ctx.voice_client
+        if voice_client.is_playing() or self.is_paused or self.queue or self.advancing:
+            # queue unresolved track right away, prefetch stage resolves it before its turn
+            self.queue.append(Track(None, query, STREAM, requester=ctx.author.id, query=query))
+            self._prefetch()
+            return f"Added to de queue [position {len(self.queue)}]: {query}"
+
+        # nothing playing, resolve now and start immediately
+        self.pending_resolves += 1
+        try:
+            stream_url, title, duration = await self.resolver(query)
+        finally:
+            self.pending_resolves -= 1
+        if not stream_url:
+            return "De Zulu cannot find dis track. It is probably age-restricted and yu ah but a bebeh. Zulu will fix anodda time"
+        track = Track(stream_url, title, STREAM, duration=duration, requester=ctx.author.id)
+        return await self._play_entry(ctx, track)
+
+    async def enqueue_playlist(self, ctx, pages):
+        """queue playlist from async iterator of pages of (video_url, title, duration) tuples
+        
+        first page is queued before returning, remaining pages stream in from background task;
+        stream urls are only resolved by prefetch shortly before each track plays
+        """
+        pages = pages.__aiter__()
+        # keep player from being released while first page is fetched
+        self.pending_resolves += 1
+        try:
+            first_page = await pages.__anext__()
+        except StopAsyncIteration:
+            first_page = []
+        finally:
+            self.pending_resolves -= 1
+        if not first_page:
+            return "De Zulu cannot find any tracks in dis playlist."
+        
+        self._queue_page(ctx, first_page)
+
+        # keep paging rest of playlist in background
+        task = asyncio.create_task(self._queue_remaining_pages(ctx, pages, len(first_page)))
+        self.playlist_tasks.add(task)
+        task.add_done_callback(self.playlist_tasks.discard)
+
+        # start playing if nothing else is
+        if not ctx.voice_client.is_playing() and not self.is_paused and not self.current_track and not self.advancing:
+            await self._play_next(ctx)
+        return f"Added {len(first_page)} tracks from de playlist to de queue. De Zulu is fetching de rest..."
+
+    def _queue_page(self, ctx, page):
+        """append page of unresolved playlist tracks to queue"""
+        for video_url, title, duration in page:
+            self.queue.append(Track(None, title, STREAM, duration=duration,
+                                    requester=ctx.author.id, query=video_url))
+        self._prefetch()
+
+    async def _queue_remaining_pages(self, ctx, pages, queued):
+        """queue remaining playlist pages as they arrive"""
+        async for page in pages:
+            self._queue_page(ctx, page)
+            queued += len(page)
+        await ctx.send(f"De Zulu has queued all {queued} tracks from de playlist.")
+
+    async def play(self, ctx, source, title, is_stream=False):
         """play an audio file from filepath or stream url"""
+        entry = Track.from_source(source, title, is_stream, requester=ctx.author.id)
+        return await self._play_entry(ctx, entry)
+
+    async def _play_entry(self, ctx, entry, from_queue=False):
+        """start entry now, or add it to queue if something is already playing
+        
+        entries coming from head of queue go back to the front if they get bumped
+        """
         voice_client = ctx.voice_client
-        if voice_client.is_playing():
+        if voice_client.is_playing() or (self.advancing and not from_queue):
             # add audio to queue if already playing
-            self.queue.append((source, title, is_stream, text_callback))
-            return f"Added to de queue [position {len(self.queue)}]: {title}"
+            return self._requeue(entry, from_queue)
 
         try:
-            if is_stream:
-                # stream options for urls
-                ffmpeg_options = {
-                    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
-                    'options': '-vn'  # disable video
-                }
-                # create audio source from stream url with ffmpeg
-                audio_source = discord.FFmpegPCMAudio(source, **ffmpeg_options)
-
-                # volume control (to bring in line with speech volume)
-                audio_source = discord.PCMVolumeTransformer(audio_source, volume=0.5)
+            audio_source = await self._create_audio_source(entry.source, entry.is_stream)
 
-            else:
-                # create ffmpeg audio source from download filepath
-                audio_source = discord.FFmpegPCMAudio(source)
+            # something may have started while stream was being probed
+            if voice_client.is_playing():
+                audio_source.cleanup()
+                return self._requeue(entry, from_queue)
             
             # play audio with _song_finished callback
             voice_client.play(audio_source, after=lambda e: asyncio.run_coroutine_threadsafe(
@@ -45,18 +135,89 @@ class AudioPlayer:
             
             self.is_playing = True
             self.is_paused = False
-            self.current_track = (source, title, is_stream, text_callback)
-
-            # execute text callback immediately if audio starts playing now
-            if text_callback:
-                await text_callback()
+            self.current_track = entry
             
-            return f"▶️ Now playing: {title}"
+            return f"▶️ Now playing: {entry.title}"
             
         except Exception as e:
             print(f"Error playing audio: {e}")
+            if self.current_track is not entry:
+                self._release_clip(entry)
             return f"Error playing: {str(e)}"
     
+    def _requeue(self, entry, front=False):
+        """put entry back into queue, at front if it was already next in line"""
+        if front:
+            self.queue.appendleft(entry)
+            return f"Added to de queue [position 1]: {entry.title}"
+        self.queue.append(entry)
+        return f"Added to de queue [position {len(self.queue)}]: {entry.title}"
+
+    async def enqueue_speech(self, ctx, title, sources):
+        """queue speech segments as one uninterrupted block, in order
+        
+        sources are awaitables each giving audio source for one segment (synthesized concurrently),
+        segments wait in queue for their audio so other users' tracks can't slip in between
+        """
+        tracks = []
+        group = next(self.speech_groups)
+        for i, source in enumerate(sources, 1):
+            track = Track(None, f"{title} (part {i}/{len(sources)})", MEMORY,
+                          requester=ctx.author.id, announce=(i == 1), group=group)
+            track.state = RESOLVING
+            track.resolve_task = asyncio.create_task(self._await_source(track, source))
+            tracks.append(track)
+        
+        position = len(self.queue) + 1
+        self.queue.extend(tracks)
+
+        if not ctx.voice_client.is_playing() and not self.is_paused and not self.advancing:
+            # starting right away, caller reports now playing itself
+            tracks[0].announce = False
+            await self._play_next(ctx)
+            return f"▶️ Now playing: {title}"
+        return f"Added to de queue [position {position}]: {title}"
+
+    async def _await_source(self, track, source):
+        """wait for segment audio and fill in track"""
+        try:
+            audio = await source
+        except Exception as e:
+            print(f"Error generating speech segment: {e}")
+            audio = None
+        
+        if audio is None:
+            track.state = FAILED
+            return
+        track.source = audio
+        track.kind = FILE if isinstance(audio, str) else MEMORY
+        track.state = READY
+
+    async def _create_audio_source(self, source, is_stream):
+        """create opus audio source so ffmpeg does all decoding, volume and encoding"""
+        if is_stream:
+            # stream options for urls
+            before_options = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+
+            if self.stream_volume == 1.0:
+                # no volume change needed, probe stream and copy opus packets as-is when possible
+                return await discord.FFmpegOpusAudio.from_probe(
+                    source, method='fallback', before_options=before_options, options='-vn')
+            
+            # volume control inside ffmpeg (to bring in line with speech volume), encoded straight to opus
+            return discord.FFmpegOpusAudio(
+                source, before_options=before_options, options=f'-vn -af volume={self.stream_volume}')
+
+        # limiter keeps boosted speech (elevenlabs clips peak near full scale) from clipping
+        speech_options = f'-af volume={self.speech_volume},alimiter=limit=0.9' if self.speech_volume != 1.0 else None
+
+        # in-memory tts stream is piped into ffmpeg's stdin as chunks arrive
+        if hasattr(source, 'read'):
+            return discord.FFmpegOpusAudio(source, pipe=True, options=speech_options)
+
+        # create ffmpeg audio source from cached clip filepath (tts clips are mp3, so no probing needed)
+        return discord.FFmpegOpusAudio(source, options=speech_options)
+
     async def pause(self, voice_client):
         """pause current playback"""
         if voice_client and voice_client.is_playing() and not self.is_paused:
@@ -75,8 +236,22 @@ class AudioPlayer:
             return "▶️ De Zulu has resumed de playback."
         return "How can de Zulu resume when notting is playing?"
     
-    async def skip(self, voice_client):
+    async def skip(self, ctx):
         """skip to next track in queue"""
+        voice_client = ctx.voice_client
+        if self.advancing:
+            # next track is still being started, skip it there instead of starting anudda advance
+            self.skip_pending = True
+            track = self.advancing_track
+            if track and track.resolve_task and not track.resolve_task.done():
+                track.resolve_task.cancel()
+            self._drop_group(track)
+            return "⏭️ De Zulu is skipping to de next track..."
+
+        if voice_client.is_playing() or self.is_paused:
+            # skipping speech skips rest of answer, not just current sentence
+            self._drop_group(self.current_track)
+
         if len(self.queue) == 0:
             if voice_client.is_playing() or self.is_paused:
                 voice_client.stop()
@@ -89,8 +264,10 @@ class AudioPlayer:
             return "⏭️ De Zulu is skipping to de next track..."
         else:
             # if nothing playing but queue has items, play next item
-            await self._play_next(voice_client)
-            return f"▶️ Now playing: {self.current_track[1]}"
+            await self._play_next(ctx)
+            if self.current_track:
+                return f"▶️ Now playing: {self.current_track.title}"
+            return "De Zulu could not play de next track."
 
     async def get_queue(self):
         """get formatted queue status message"""
@@ -100,24 +277,92 @@ class AudioPlayer:
         status = []
         
         if self.current_track:
-            status.append(f"▶️ **Now Playing:** {self.current_track[1]}")
+            status.append(f"▶️ **Now Playing:** {self._format_track(self.current_track)}")
             
         if self.queue:
             status.append("\n**Queue:**")
-            for i, (_, title, _) in enumerate(self.queue, 1):
-                status.append(f"{i}. {title}")
+            # only list head of queue, large playlists would blow past message limit
+            for i, track in enumerate(islice(self.queue, self.queue_display_limit), 1):
+                status.append(f"{i}. {self._format_track(track)}")
+            
+            hidden = len(self.queue) - self.queue_display_limit
+            if hidden > 0:
+                status.append(f"...and {hidden} mo")
+
+            # total length of tracks with known duration
+            total = sum(track.duration for track in self.queue if track.duration)
+            if total:
+                status.append(f"\n{len(self.queue)} tracks, {format_duration(total)} total")
         else:
             status.append("\nDer are no mo tracks in de queue.")
             
         return "\n".join(status)
 
+    def _format_track(self, track):
+        """format track title with duration if known"""
+        if track.duration:
+            return f"{track.title} [{format_duration(track.duration)}]"
+        return track.title
+
+    def move(self, from_position, to_position):
+        """move queued track from one position to another (1-based)"""
+        if not (1 <= from_position <= len(self.queue)) or not (1 <= to_position <= len(self.queue)):
+            return "Dat position is not in de queue."
+        
+        track = self.queue[from_position - 1]
+        del self.queue[from_position - 1]
+        self.queue.insert(to_position - 1, track)
+        self._prefetch()
+        return f"De Zulu has moved {track.title} to position {to_position}."
+
+    def remove(self, position):
+        """remove queued track at position (1-based)"""
+        if not (1 <= position <= len(self.queue)):
+            return "Dat position is not in de queue."
+        
+        track = self.queue[position - 1]
+        del self.queue[position - 1]
+        self._drop_track(track)
+        self._prefetch()
+        return f"De Zulu has removed {track.title} from de queue."
+
+    def shuffle(self):
+        """shuffle queued tracks"""
+        if len(self.queue) < 2:
+            return "Der is notting to shuffle."
+        
+        # shuffle as list, deque index access is slow in the middle
+        tracks = list(self.queue)
+        random.shuffle(tracks)
+        self.queue = deque(tracks)
+        self._prefetch()
+        return "🔀 De Zulu has shuffled de queue."
+
+    def clear_by_user(self, user_id):
+        """remove all queued tracks requested by user"""
+        kept = deque()
+        removed = 0
+        for track in self.queue:
+            if track.requester == user_id:
+                self._drop_track(track)
+                removed += 1
+            else:
+                kept.append(track)
+        self.queue = kept
+        self._prefetch()
+        
+        if not removed:
+            return "Yu have no tracks in de queue."
+        return f"De Zulu has removed yoh {removed} tracks from de queue."
+
     async def stop(self, voice_client):
         """stop playback and clear queue"""
         if voice_client and (voice_client.is_playing() or self.is_paused):
             voice_client.stop()
-            self.queue = []
+            self.clear_queue()
             self.is_playing = False
             self.is_paused = False
+            self._release_clip(self.current_track)
             self.current_track = None
 
             # give some time for processes to clean up
@@ -125,7 +370,7 @@ class AudioPlayer:
             
             return "⏹️ De Zulu has stopped de playback and cleared de queue."
         elif len(self.queue) > 0:
-            self.queue = []
+            self.clear_queue()
             return "De Zulu has cleared de queue."
         return "How can de Zulu stop when notting is playing?"
     
@@ -136,69 +381,151 @@ class AudioPlayer:
         if error:
             print(f"Error in playback: {error}")
 
-        finished_track = self.current_track
-        
+        self._release_clip(self.current_track)
         self.current_track = None
         self.is_playing = False
         self.is_paused = False      
-
-        # check if finished track was file that needs cleanup
-        if finished_track and not finished_track[2]:  # if not a stream
-            await self.cleanup()
         
         # play next song in queue if any
         if self.queue and len(self.queue) > 0:
             await self._play_next(ctx)
+        elif self.on_idle:
+            # nothing left to play, let owner release this player
+            self.on_idle(self.server_id)
+
+    def clear_queue(self):
+        """empty queue and cancel any background resolution or playlist paging still running"""
+        for task in list(self.playlist_tasks):
+            task.cancel()
+        for track in self.queue:
+            self._drop_track(track)
+        self.queue = deque()
+
+    def _drop_track(self, track):
+        """cancel track's background resolution or synthesis and unpin its clip"""
+        if track.resolve_task and not track.resolve_task.done():
+            track.resolve_task.cancel()
+        # speech still streaming in would otherwise keep using elevenlabs quota and a synthesis slot
+        pump_task = getattr(track.source, 'pump_task', None)
+        if pump_task and not pump_task.done():
+            pump_task.cancel()
+        self._release_clip(track)
+
+    def _drop_group(self, track):
+        """drop queued segments of same spoken answer as track"""
+        if not track or track.group is None:
+            return
+        remaining = deque()
+        for queued in self.queue:
+            if queued.group == track.group:
+                self._drop_track(queued)
+            else:
+                remaining.append(queued)
+        self.queue = remaining
+
+    def _release_clip(self, track):
+        """let clip cache evict track's file again (streams and in-memory audio aren't pinned)"""
+        if self.clip_cache and track and track.is_file:
+            self.clip_cache.release(track.source)
+
+    def _prefetch(self):
+        """start resolving the next few queued tracks in the background"""
+        if not self.resolver:
+            return
+        for track in islice(self.queue, self.prefetch_depth):
+            if track.needs_resolve and track.resolve_task is None:
+                track.resolve_task = asyncio.create_task(self._resolve_entry(track))
+
+    async def _resolve(self, track):
+        """wait for track to be resolved, starting resolution if prefetch hasn't yet"""
+        if track.resolve_task is None:
+            track.resolve_task = asyncio.create_task(self._resolve_entry(track))
+        # wait without raising if resolution gets cancelled by skip
+        await asyncio.wait({track.resolve_task})
+
+    async def _resolve_entry(self, track):
+        """resolve track query and fill in stream url, real title and duration"""
+        track.state = RESOLVING
+        try:
+            stream_url, title, duration = await self.resolver(track.query)
+        except Exception as e:
+            print(f"Error resolving track {track.query}: {e}")
+            track.state = FAILED
+            return
+        
+        if stream_url:
+            track.source = stream_url
+            track.title = title
+            track.duration = duration
+            track.state = READY
+        else:
+            track.state = FAILED
+
+    def is_idle(self):
+        """check if player has nothing playing, paused or queued"""
+        return not self.is_playing and not self.is_paused and not self.queue and not self.pending_resolves and not self.playlist_tasks
 
     async def _play_next(self, ctx):
         """play next item in queue"""
         if not self.queue:
             return
             
-        next_item = self.queue.pop(0)
-        source_url, title, is_stream, text_callback = next_item
+        next_item = self.queue.popleft()
+
+        # keep look-ahead window full now that queue has shifted
+        self._prefetch()
         
+        self.advancing = True
+        self.advancing_track = next_item
+        self.skip_pending = False
         try:
+            # wait for background resolution if entry is still a search term, url or synthesizing speech
+            if next_item.needs_resolve:
+                await self._resolve(next_item)
+
+                # user skipped track while it was resolving
+                if self.skip_pending:
+                    self._drop_track(next_item)
+                    await self._advance_past(ctx)
+                    return
+
+                if next_item.state != READY:
+                    if next_item.is_stream:
+                        await ctx.send(f"De Zulu cannot find dis track: {next_item.title}")
+                    else:
+                        await ctx.send("De Zulu has lost his tongue.")
+                    await self._advance_past(ctx)
+                    return
+
             # send message to text channel from callback (callback messages need to be explicitly sent back)
-            await ctx.send(f"▶️ Now Playing: {title}") 
+            if next_item.announce:
+                await ctx.send(f"▶️ Now Playing: {next_item.title}") 
+
+            await self._play_entry(ctx, next_item, from_queue=True)
 
-            await self.play(ctx, source_url, title, is_stream, text_callback)
+            # skip arrived while stream was being probed, stopping triggers _song_finished
+            if self.skip_pending and self.current_track is next_item and ctx.voice_client.is_playing():
+                ctx.voice_client.stop()
         
         except Exception as e:
             print(f"Error playing next track: {e}")
+            self.advancing = False
             # try to play next track in queue if this one fails
             if self.queue:
-                await self._play_next(ctx.voice_client)
-    
-    async def cleanup(self):
-        """delete all downloaded files"""
-        try:
-            # add short delay to allow ffmpeg to release file handles
-            await asyncio.sleep(2)
-
-            # get current file path if track is playing
-            current_file = None
-            if self.current_track and not self.current_track[2]: # if a file, not a stream
-                current_file = self.current_track[0]
-
-            # check if directory exists
-            if os.path.exists(self.download_dir):
-                # delete each individual file except the current one
-                for file in os.listdir(self.download_dir):
-                    file_path = os.path.join(self.download_dir, file)
-                    
-                    # skip the file that's currently playing
-                    if current_file and file_path == current_file:
-                        print(f"Skipping currently playing file: {file_path}")
-                        continue
-                        
-                    try:
-                        if os.path.isfile(file_path):
-                            os.remove(file_path)
-                            print(f"Cleaned up file: {file_path}")
-                    except Exception as e:
-                        print(f"Error removing file {file_path}: {e}")
-                return True
-        except Exception as e:
-            print(f"Error cleaning up downloads: {e}")
-            return False
\ No newline at end of file
+                await self._play_next(ctx)
+        finally:
+            # nested advances (after failed or skipped tracks) reset state themselves
+            if self.advancing_track is next_item:
+                self.advancing = False
+                self.advancing_track = None
+                self.skip_pending = False
+
+    async def _advance_past(self, ctx):
+        """move on from track that won't be played"""
+        self.advancing = False
+        self.advancing_track = None
+        self.skip_pending = False
+        if self.queue:
+            await self._play_next(ctx)
+        elif self.on_idle:
+            self.on_idle(self.server_id)
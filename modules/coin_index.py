@@ -0,0 +1,112 @@
+# modules/coin_index.py
+import bisect
+import difflib
+from modules.utils import TTLCache
+
+class CoinIndex:
+    """in-memory index of cmc coin map for resolving names/symbols/slugs to coin ids locally"""
+    def __init__(self, min_prefix_length=3, fuzzy_cutoff=0.85, fuzzy_rank_limit=1000):
+        self.min_prefix_length = min_prefix_length
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.fuzzy_rank_limit = fuzzy_rank_limit    # only coins ranked this high are matched with typos
+        self.loaded_at = None
+
+        self.coins = {}         # id -> {"id", "symbol", "slug", "name", "rank"}
+        self.exact = {}         # lowercase symbol/slug/name -> list of ids
+        self.sorted_keys = []   # sorted lowercase names/slugs for prefix matching
+        self.fuzzy_keys = []    # names/slugs of top ranked coins for fuzzy matching
+
+        # resolved queries (misses too) -> (coin id,), so repeat lookups skip matching entirely
+        self.resolved = TTLCache(max_entries=2000, ttl=3600)
+
+    def load(self, coin_map, loaded_at=None):
+        """rebuild index from cmc /cryptocurrency/map entries"""
+        coins = {}
+        exact = {}
+        for entry in coin_map:
+            coin_id = entry.get("id")
+            if not isinstance(coin_id, int):
+                continue
+            coin = {
+                "id": coin_id,
+                "symbol": entry.get("symbol") or "",
+                "slug": (entry.get("slug") or "").lower(),
+                "name": entry.get("name") or "",
+                "rank": entry.get("rank"),
+            }
+            coins[coin_id] = coin
+            for key in {coin["symbol"].lower(), coin["slug"], coin["name"].lower()}:
+                if key:
+                    exact.setdefault(key, []).append(coin_id)
+
+        # symbols are only matched exactly, names and slugs also by prefix
+        sorted_keys = sorted({key for coin in coins.values() for key in (coin["slug"], coin["name"].lower()) if key})
+
+        # fuzzy matching scans every key, so it's kept to coins people are likely to ask about
+        fuzzy_keys = sorted({key for coin in coins.values() if coin["rank"] and coin["rank"] <= self.fuzzy_rank_limit
+            for key in (coin["slug"], coin["name"].lower()) if key})
+
+        # swap in new index all at once so lookups never see half-built state
+        self.coins, self.exact, self.sorted_keys, self.fuzzy_keys = coins, exact, sorted_keys, fuzzy_keys
+        self.resolved.clear()
+        self.loaded_at = loaded_at
+        print(f"Coin index loaded with {len(coins)} coins")
+
+    def is_loaded(self):
+        return bool(self.coins)
+
+    def get(self, coin_id):
+        return self.coins.get(coin_id)
+
+    def resolve(self, text):
+        """resolve user query to best-ranked coin id, or None if nothing matches"""
+        query = text.strip().lower()
+        if not query:
+            return None
+        cached = self.resolved.get(query)
+        if cached is not None:
+            return cached[0]
+        coin_id = self._match(query)
+        self.resolved.put(query, (coin_id,))
+        return coin_id
+
+    def _match(self, query):
+        """match lowercase query against index, trying cheapest lookups first"""
+        coins, exact = self.coins, self.exact
+
+        # 1. exact match on symbol, slug or name
+        candidates = exact.get(query) or exact.get(query.replace(' ', '-'))
+        if candidates:
+            return self._best_ranked(coins, candidates)
+
+        # 2. prefix match on name or slug
+        if len(query) >= self.min_prefix_length:
+            candidates = self._prefix_matches(query, exact)
+            if candidates:
+                return self._best_ranked(coins, candidates)
+
+        # 3. fuzzy match on name or slug (typos)
+        matches = difflib.get_close_matches(query, self.fuzzy_keys, n=3, cutoff=self.fuzzy_cutoff)
+        if matches:
+            return self._best_ranked(coins, [coin_id for match in matches for coin_id in exact[match]])
+        return None
+
+    def _prefix_matches(self, query, exact):
+        """find ids of all names/slugs starting with query using binary search over sorted keys"""
+        sorted_keys = self.sorted_keys
+        candidates = []
+        index = bisect.bisect_left(sorted_keys, query)
+        while index < len(sorted_keys) and sorted_keys[index].startswith(query):
+            candidates.extend(exact[sorted_keys[index]])
+            index += 1
+        return candidates
+
+    def _best_ranked(self, coins, candidates):
+        """pick candidate with best market cap rank (unranked coins last, then lowest id)"""
+        def sort_key(coin_id):
+            rank = coins[coin_id]["rank"]
+            return (rank is None, rank or 0, coin_id)
+        return min(candidates, key=sort_key)
+
+    def stats(self):
+        return {"coins": len(self.coins), "keys": len(self.exact), "loaded_at": self.loaded_at}
@@ -0,0 +1,65 @@
+# modules/coin_metadata.py
+import os
+import json
+import time
+import threading
+from modules.utils import save_json_atomic
+
+class CoinMetadataStore:
+    """persistent store of coin logos/descriptions keyed by coin id (these rarely change)"""
+    def __init__(self, cache_path="cache/coin_metadata.json", ttl=7 * 86400):
+        self.cache_path = cache_path    # set to None to keep store in memory only
+        self.ttl = ttl
+        self.entries = {}               # coin id (str) -> {"logo", "description", "fetched_at"}
+        self.lock = threading.Lock()    # saving runs in worker thread
+
+        self.load()
+
+    def get(self, coin_id, allow_expired=False):
+        """get metadata for coin id if not expired"""
+        entry = self.entries.get(str(coin_id))
+        if entry and (allow_expired or entry["fetched_at"] + self.ttl > time.time()):
+            return entry
+        return None
+
+    def missing(self, coin_ids):
+        """get coin ids with no unexpired metadata"""
+        return [coin_id for coin_id in coin_ids if not self.get(coin_id)]
+
+    def put_many(self, metadata):
+        """store entries from cmc /cryptocurrency/info response data"""
+        now = time.time()
+        with self.lock:
+            for coin_id, coin in metadata.items():
+                # info endpoint returns a list per key when queried by symbol
+                if isinstance(coin, list):
+                    coin = coin[0] if coin else {}
+                self.entries[str(coin_id)] = {
+                    "logo": coin.get("logo"),
+                    "description": coin.get("description"),
+                    "fetched_at": now,
+                }
+
+    def load(self):
+        """load entries from disk (expired ones are kept and refreshed when next requested)"""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            with self.lock:
+                self.entries.update(data)
+            print(f"Loaded metadata for {len(self.entries)} coins")
+        except Exception as e:
+            print(f"Error loading coin metadata store: {e}")
+
+    def save(self):
+        """write store to disk (via temp file so a crash never leaves it half written)"""
+        if not self.cache_path:
+            return
+        try:
+            with self.lock:
+                data = dict(self.entries)
+            save_json_atomic(self.cache_path, data)
+        except Exception as e:
+            print(f"Error saving coin metadata store: {e}")
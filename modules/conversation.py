@@ -0,0 +1,91 @@
+# modules/conversation.py
+import asyncio
+from collections import OrderedDict, deque
+from modules.utils import estimate_tokens
+
+class Conversation:
+    """recent turns of one channel plus rolling summary of older ones"""
+    def __init__(self):
+        self.turns = deque()        # (speaker, text, tokens), oldest first
+        self.summary = ""
+        self.tokens = 0             # tokens of summary + turns
+        self.compacting = False
+
+class ConversationStore:
+    def __init__(self, llm, token_budget=1500, keep_recent=4, max_turns=40, max_channels=500):
+        self.llm = llm                      # used to summarize old turns
+        self.token_budget = token_budget    # history above this gets compacted
+        self.keep_recent = keep_recent      # turns never compacted (latest exchanges stay verbatim)
+        self.max_turns = max_turns          # compact regardless of tokens past this many turns
+        self.max_channels = max_channels
+        self.conversations = OrderedDict()  # channel id -> Conversation, least recently active first
+
+    def get_history(self, channel_id):
+        """format channel's conversation so far for prompt (empty if none)"""
+        conversation = self.conversations.get(channel_id)
+        if not conversation or (not conversation.turns and not conversation.summary):
+            return ""
+        
+        lines = ["Conversation so far in this chat (use it for context, do not repeat it):"]
+        if conversation.summary:
+            lines.append(f"Summary of earlier conversation: {conversation.summary}")
+        for speaker, text, _ in conversation.turns:
+            lines.append(f"{speaker}: {text}")
+        return "\n".join(lines) + "\n\n"
+
+    def add_exchange(self, channel_id, user_name, message, bot_name, response):
+        """record user message and bot response, compacting in background if over budget"""
+        conversation = self.conversations.get(channel_id)
+        if conversation is None:
+            conversation = Conversation()
+            self.conversations[channel_id] = conversation
+            # forget least recently active channel over the limit
+            if len(self.conversations) > self.max_channels:
+                self.conversations.popitem(last=False)
+        self.conversations.move_to_end(channel_id)
+
+        for speaker, text in ((user_name, message), (bot_name, response)):
+            tokens = estimate_tokens(text)
+            conversation.turns.append((speaker, text, tokens))
+            conversation.tokens += tokens
+
+        over_budget = conversation.tokens > self.token_budget or len(conversation.turns) > self.max_turns
+        if over_budget and not conversation.compacting and len(conversation.turns) > self.keep_recent:
+            conversation.compacting = True
+            asyncio.create_task(self._compact(conversation))
+
+    def clear(self, channel_id):
+        """forget channel's conversation"""
+        self.conversations.pop(channel_id, None)
+
+    async def _compact(self, conversation):
+        """fold oldest turns into rolling summary until history is back under budget"""
+        try:
+            # take oldest turns until remaining history fits in half the budget (leaves room to grow)
+            old_turns = []
+            remaining = conversation.tokens
+            while len(conversation.turns) - len(old_turns) > self.keep_recent and (
+                    remaining > self.token_budget // 2 or len(conversation.turns) - len(old_turns) > self.max_turns // 2):
+                turn = conversation.turns[len(old_turns)]
+                old_turns.append(turn)
+                remaining -= turn[2]
+            if not old_turns:
+                return
+            
+            transcript = "\n".join(f"{speaker}: {text}" for speaker, text, _ in old_turns)
+            summary = await self.llm.summarize(conversation.summary, transcript, self.token_budget // 4)
+            if not summary:
+                # keep turns so nothing is lost, compaction is retried on next exchange
+                return
+
+            # drop summarized turns (new turns may have been appended meanwhile, they stay)
+            for _ in old_turns:
+                _, _, tokens = conversation.turns.popleft()
+                conversation.tokens -= tokens
+            conversation.tokens -= estimate_tokens(conversation.summary) if conversation.summary else 0
+            conversation.summary = summary
+            conversation.tokens += estimate_tokens(summary)
+        except Exception as e:
+            print(f"Error compacting conversation: {e}")
+        finally:
+            conversation.compacting = False
@@ -1,58 +1,280 @@
 # modules/crypto_client.py
-from requests import Request, Session
-from requests.exceptions import ConnectionError, Timeout, TooManyRedirects
+import aiohttp
 from dotenv import load_dotenv
 import json
 import os
+import random
+import asyncio
+import time
 import discord
 import functools
+from io import BytesIO
+from modules.coin_index import CoinIndex
+from modules.market_snapshot import MarketSnapshot
+from modules.coin_metadata import CoinMetadataStore
+from modules.price_history import PriceHistory
+from modules.price_alerts import AlertEngine, ABOVE
 
 def handle_exceptions(func):
-    """decorator for handling crypto api exceptions"""
+    """decorator for handling crypto api exceptions (returns (embed, file) like the wrapped methods)"""
     @functools.wraps(func)
-    def wrapper(self, *args, **kwargs):
+    async def wrapper(self, *args, **kwargs):
         func_name = func.__name__
         try:
-            return func(self, *args, **kwargs)
-        except (ConnectionError, Timeout, TooManyRedirects) as e:
+            return await func(self, *args, **kwargs)
+        except (aiohttp.ClientConnectionError, aiohttp.TooManyRedirects, asyncio.TimeoutError) as e:
             print(f"Error in {func_name} {e}")
             return self.create_error_embed("Connection Error", 
-                "De spirits of de digital realm are silent today. De Zulu cannot reach dem... Try again later.")
+                "De spirits of de digital realm are silent today. De Zulu cannot reach dem... Try again later."), None
         except Exception as e:
             print(f"Error in {func_name}: {e}")
             return self.create_error_embed("Error",
-                "De Zulu has failed to hona de command and has brought shame upon de tribe.")
+                "De Zulu has failed to hona de command and has brought shame upon de tribe."), None
     return wrapper
 
 # endpoint overview: https://coinmarketcap.com/api/documentation/v1/#section/Endpoint-Overview
 class CryptoClient:
-    def __init__(self):
+    def __init__(self, snapshot_size=200, snapshot_interval=60):
         load_dotenv()
         self.api_key = os.getenv('COINMARKETCAP_API_KEY')
         self.listings_url = 'https://pro-api.coinmarketcap.com/v1/cryptocurrency/listings/latest'
         self.quotes_url = 'https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/latest'
         self.metadata_url = 'https://pro-api.coinmarketcap.com/v2/cryptocurrency/info'
-        self.session = Session()
-        self.session.headers.update({
+        self.map_url = 'https://pro-api.coinmarketcap.com/v1/cryptocurrency/map'
+        self.headers = {
             'Accepts': 'application/json',
             'X-CMC_PRO_API_KEY': self.api_key,
-        })
+        }
+        # shared keep-alive connection pool, created on first request (needs running event loop)
+        self.session = None
+        self.timeout = aiohttp.ClientTimeout(total=20, connect=5, sock_read=10)
+        
+        # retry settings for rate limiting (429) and server errors (5xx)
+        self.max_retries = 3
+        self.retry_base_delay = 0.5     # seconds, doubled each attempt plus random jitter
+
+        # local coin map so queries resolve to an id without extra api calls
+        self.coin_index = CoinIndex()
+        self.index_refresh_interval = 6 * 3600     # new listings are rare, refresh a few times a day
+        self.index_retry_interval = 300
+
+        # listings for top coins refreshed in background, commands read it without any api calls
+        self.snapshot = None
+        self.snapshot_size = snapshot_size
+        self.snapshot_interval = snapshot_interval     # cmc quotes update about once a minute
+        self.snapshot_max_age = snapshot_interval * 5  # fall back to live calls if refresh keeps failing
+        self.top_coins_limit = 6
+        self.refresh_tasks = []
+
+        # logos + descriptions persisted on disk, warmed in bulk for coins in snapshot
+        self.metadata_store = CoinMetadataStore()
+        self.metadata_batch_size = 100     # info endpoint charges one credit per 100 ids
+
+        # every snapshot poll is recorded for sparkline charts in coin embeds
+        self.price_history = PriceHistory(max_coins=snapshot_size)
+        self.chart_filename = "sparkline.png"
+
+        # price alerts checked against every snapshot poll, callback receives (triggered alerts, prices)
+        self.alerts = AlertEngine()
+        self.alert_callback = None
+        self.alert_tasks = set()    # notifications still being sent
+
         # emoji mapping for price changes
         self.up_arrow = "⬆️"
         self.down_arrow = "⬇️"
 
         self.footer = "De data provided by de CoinMarketCap"
 
+    async def get_session(self):
+        """get shared http session, creating it if nonexistent"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=20, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(headers=self.headers, timeout=self.timeout, connector=connector)
+        return self.session
+
+    def start(self):
+        """start background refresh of local coin data (safe to call on every reconnect)"""
+        if any(not task.done() for task in self.refresh_tasks):
+            return
+        self.refresh_tasks = [
+            asyncio.create_task(self._refresh_loop("coin index", self.refresh_coin_index,
+                self.index_refresh_interval, self.index_retry_interval)),
+            asyncio.create_task(self._refresh_loop("market snapshot", self.refresh_snapshot,
+                self.snapshot_interval, self.snapshot_interval)),
+        ]
+
+    async def close(self):
+        """stop background refresh and close http session"""
+        for task in self.refresh_tasks:
+            task.cancel()
+        self.price_history.close()
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+    async def _refresh_loop(self, name, refresh, interval, retry_interval):
+        """periodically run refresh coroutine"""
+        while True:
+            try:
+                await refresh()
+                delay = interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error refreshing {name}: {e}")
+                delay = retry_interval
+            await asyncio.sleep(delay)
+
+    async def refresh_snapshot(self):
+        """fetch listings for top coins and swap in new market snapshot"""
+        params = {
+            'start': '1',
+            'limit': str(self.snapshot_size),
+            'convert': 'USD'
+        }
+        status, response_text = await self.get(self.listings_url, params, "refresh_snapshot")
+        if status != 200:
+            raise RuntimeError(f"listings request failed with status {status}")
+        self.snapshot = MarketSnapshot(json.loads(response_text).get("data") or [])
+
+        # record polled prices
+        self.price_history.record_many(
+            ((coin["id"], coin.get("quote", {}).get("USD", {}).get("price")) for coin in self.snapshot.ranked),
+            self.snapshot.fetched_at)
+        await asyncio.to_thread(self.price_history.save)
+
+        # check all alerts against this poll in one batch
+        prices = {coin["id"]: coin.get("quote", {}).get("USD", {}).get("price") for coin in self.snapshot.ranked}
+        triggered = self.alerts.check(prices)
+        if triggered:
+            await asyncio.to_thread(self.alerts.save)
+            if self.alert_callback:
+                # notify in background so rate limited sends never hold up polling
+                task = asyncio.create_task(self.alert_callback(triggered, prices))
+                self.alert_tasks.add(task)
+                task.add_done_callback(self.alert_tasks.discard)
+
+        # fetch metadata for coins that entered snapshot (or whose metadata expired)
+        try:
+            await self.warm_metadata([coin["id"] for coin in self.snapshot.ranked])
+        except Exception as e:
+            print(f"Error warming coin metadata: {e}")
+
+    def current_snapshot(self):
+        """get market snapshot if recent enough to serve from, else None"""
+        snapshot = self.snapshot
+        if snapshot and snapshot.age() <= self.snapshot_max_age:
+            return snapshot
+        return None
+
+    def is_cached(self, text=""):
+        """check if query (empty for top coins) can be answered from memory without any api calls"""
+        snapshot = self.current_snapshot()
+        if not snapshot:
+            return False
+        if not text:
+            return len(snapshot) >= self.top_coins_limit
+        if not self.coin_index.is_loaded():
+            return False
+        coin_id = self.coin_index.resolve(text)
+        return coin_id is not None and snapshot.get(coin_id) is not None and self.metadata_store.get(coin_id) is not None
+
+    async def refresh_coin_index(self, page_size=5000):
+        """fetch full active coin map from api and rebuild local index"""
+        coin_map = []
+        start = 1
+        while True:
+            params = {
+                'listing_status': 'active',
+                'start': str(start),
+                'limit': str(page_size),
+                'sort': 'cmc_rank',
+            }
+            status, response_text = await self.get(self.map_url, params, "refresh_coin_index")
+            if status != 200:
+                raise RuntimeError(f"coin map request failed with status {status}")
+            page = json.loads(response_text).get("data") or []
+            coin_map.extend(page)
+            if len(page) < page_size:
+                break
+            start += page_size
+        self.coin_index.load(coin_map, loaded_at=time.time())
+
+    async def get(self, url, params, func_name):
+        """get url, retrying with jittered backoff on 429/5xx, returns (status, text)"""
+        session = await self.get_session()
+        for attempt in range(self.max_retries + 1):
+            async with session.get(url, params=params) as response:
+                text = await response.text()
+                retryable = response.status == 429 or response.status >= 500
+                if not retryable or attempt == self.max_retries:
+                    self.check_response_code(response.status, text, func_name)
+                    return response.status, text
+                
+                # honor retry-after if api sends it, else exponential backoff
+                retry_after = response.headers.get('Retry-After')
+            
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = self.retry_base_delay * (2 ** attempt)
+            delay += random.uniform(0, self.retry_base_delay)
+            print(f"{func_name}: API returned {response.status}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
     @handle_exceptions
-    def fetch_coin_data(self, text):
+    async def fetch_coin_data(self, text):
         """fetch data for specific cryptocurrency by name or symbol"""
+        # resolve query locally if coin index is available, else search api by symbol + slug
+        if self.coin_index.is_loaded():
+            coin_id = self.coin_index.resolve(text)
+            coin_data = await self.get_coin_quote(coin_id) if coin_id else None
+        else:
+            coin_data = await self.search_coin_quotes(text)
+
+        if coin_data:
+            # fetch coin_metadata using coin_id
+            coin_metadata = await self.fetch_coin_metadata(coin_data["id"])
+
+            # parse both coin_data and coin_metadata
+            parsed_coin = self.parse_single_coin(coin_data, coin_metadata)
+
+            # attach price chart if enough history has been recorded
+            chart = self.price_history.sparkline(coin_data["id"])
+            chart_file = discord.File(BytesIO(chart), filename=self.chart_filename) if chart else None
+
+            return self.create_coin_embed(parsed_coin, has_chart=bool(chart_file)), chart_file
+        
+        # if coin isn't found, return error embed
+        return self.create_error_embed("Coin Not Found", 
+            f"De Zulu knows many coins, but '{text}' is not among dem. Perhaps it is called by anudda name, or it is too small for de great spirits to notice."), None
+
+    async def get_coin_quote(self, coin_id):
+        """get latest quote for coin id from market snapshot, only calling api for coins outside it"""
+        snapshot = self.current_snapshot()
+        coin_data = snapshot.get(coin_id) if snapshot else None
+        if coin_data:
+            return coin_data
+        return await self.fetch_coin_quote(coin_id)
+
+    async def fetch_coin_quote(self, coin_id):
+        """fetch latest quote for single coin id, returns coin data or None"""
+        params = {
+            'id': str(coin_id),
+            'convert': 'USD'
+        }
+        _, response_text = await self.get(self.quotes_url, params, "fetch_coin_quote")
+        json_data = json.loads(response_text)
+        return (json_data.get("data") or {}).get(str(coin_id))
+
+    async def search_coin_quotes(self, text):
+        """search quotes by symbol and slug, returns most relevant coin data or None"""
         # found coins will contain results from both searches by symbol and slug
         # if multiple coins found, the one with lowest id (most relevant) is picked
         found_coins = {}
 
         # helper to process api response + add valid entries to found coins list
-        def add_found_coins(response):
-            json_data = json.loads(response.text)
+        def add_found_coins(response_text):
+            json_data = json.loads(response_text)
             if "data" in json_data and json_data["data"]:
                 for coin in json_data["data"].values():
                     coin_id = coin.get("id")
@@ -65,9 +287,8 @@ class CryptoClient:
             'symbol': symbol,
             'convert': 'USD'
         }
-        response = self.session.get(self.quotes_url, params=symbol_params)
-        self.check_response_code(response, "fetch_coin_data")
-        add_found_coins(response)
+        _, response_text = await self.get(self.quotes_url, symbol_params, "search_coin_quotes")
+        add_found_coins(response_text)
 
         # 2. search by slug
         slug = text.lower().replace(' ', '-')
@@ -75,56 +296,132 @@ class CryptoClient:
             'slug': slug,
             'convert': 'USD'
         }
-        response = self.session.get(self.quotes_url, params=slug_params)
-        self.check_response_code(response, "fetch_coin_data")
-        add_found_coins(response)
+        _, response_text = await self.get(self.quotes_url, slug_params, "search_coin_quotes")
+        add_found_coins(response_text)
 
         # 3. if coins found, pick the one with lowest id (most relevant)
         if found_coins:
-            lowest_id = min(found_coins.keys())
-            coin_data = found_coins[lowest_id]
-
-            # fetch coin_metadata using coin_id
-            coin_metadata = self.fetch_coin_metadata(coin_data["id"])
+            return found_coins[min(found_coins.keys())]
+        return None
 
-            # parse both coin_data and coin_metadata
-            parsed_coin = self.parse_single_coin(coin_data, coin_metadata)
+    async def fetch_coin_metadata(self, coin_id):
+        """fetch coin_metadata for given coin id, served from metadata store when possible"""
+        entry = self.metadata_store.get(coin_id)
+        if not entry:
+            try:
+                await self.warm_metadata([coin_id])
+            except Exception as e:
+                print(f"Error fetching metadata for coin {coin_id}: {e}")
+            # fall back to expired entry if api is unavailable
+            entry = self.metadata_store.get(coin_id, allow_expired=True)
+        
+        # shape matches api response expected by parse_single_coin
+        return {"data": {str(coin_id): entry}} if entry else {}
 
-            return self.create_coin_embed(parsed_coin)
+    async def warm_metadata(self, coin_ids):
+        """bulk fetch metadata for coin ids missing from metadata store"""
+        missing = self.metadata_store.missing(coin_ids)
+        if not missing:
+            return
         
-        # if coin isn't found, return error embed
-        return self.create_error_embed("Coin Not Found", 
-            f"De Zulu knows many coins, but '{text}' is not among dem. Perhaps it is called by anudda name, or it is too small for de great spirits to notice.")
-
-    def fetch_coin_metadata(self, coin_id):
-        """fetch coin_metadata for given coin id"""
-        # define request parameters and fetch data from api
-        params = {'id': str(coin_id)}   # api requires id parameter as string
-        response = self.session.get(self.metadata_url, params=params)
-        self.check_response_code(response, "fetch_coin_metadata")
-        return json.loads(response.text)
+        for i in range(0, len(missing), self.metadata_batch_size):
+            batch = missing[i:i + self.metadata_batch_size]
+            params = {'id': ','.join(str(coin_id) for coin_id in batch)}
+            status, response_text = await self.get(self.metadata_url, params, "warm_metadata")
+            if status != 200:
+                raise RuntimeError(f"metadata request failed with status {status}")
+            metadata = json.loads(response_text).get("data") or {}
+            # remember coins without metadata too, so they aren't requested again on every refresh
+            for coin_id in batch:
+                metadata.setdefault(str(coin_id), {})
+            self.metadata_store.put_many(metadata)
+        
+        await asyncio.to_thread(self.metadata_store.save)
     
     @handle_exceptions
-    def fetch_top_coins(self):
+    async def fetch_top_coins(self):
         """fetch top cryptocurrencies by market cap"""
-        # define request parameters
-        params = {
-            'start': '1',
-            'limit': '6', # get top 6
-            'convert': 'USD'
-        }
-        
-        # fetch data from api
-        response = self.session.get(self.listings_url, params=params)
-        self.check_response_code(response, "fetch_top_coins")
-        json_data = json.loads(response.text)
+        # serve from market snapshot if available
+        snapshot = self.current_snapshot()
+        if snapshot and len(snapshot) >= self.top_coins_limit:
+            json_data = {"data": snapshot.top(self.top_coins_limit)}
+        else:
+            # define request parameters
+            params = {
+                'start': '1',
+                'limit': str(self.top_coins_limit),
+                'convert': 'USD'
+            }
+            
+            # fetch data from api
+            _, response_text = await self.get(self.listings_url, params, "fetch_top_coins")
+            json_data = json.loads(response_text)
         
         # parse data
         parsed_data = self.parse_top_coins(json_data)
         
         # create and return embed
-        return self.create_top_coins_embed(parsed_data)
+        return self.create_top_coins_embed(parsed_data), None
         
+    def create_alert(self, text, direction, threshold, guild_id, channel_id, user_id):
+        """create price alert for coin in market snapshot, returns embed describing result"""
+        snapshot = self.current_snapshot()
+        coin_id = self.coin_index.resolve(text) if self.coin_index.is_loaded() else None
+        coin_data = snapshot.get(coin_id) if snapshot and coin_id else None
+        if not coin_data:
+            # alerts can only be checked for coins polled in snapshot
+            return self.create_error_embed("Coin Not Watched",
+                f"De Zulu can only watch over de top {self.snapshot_size} coins, and '{text}' is not among dem.")
+
+        name, symbol = coin_data.get("name", "Unknown"), coin_data.get("symbol", "")
+        price = coin_data.get("quote", {}).get("USD", {}).get("price") or 0
+        if (price >= threshold) if direction == ABOVE else (price <= threshold):
+            return self.create_error_embed("Alert Not Needed",
+                f"{name} is already {direction} {self.format_price(threshold)} (it is at {self.format_price(price)} now).")
+
+        alert = self.alerts.add(coin_id, name, symbol, direction, threshold, guild_id, channel_id, user_id)
+        if not alert:
+            return self.create_error_embed("Too Many Alerts",
+                f"De Zulu can only watch {self.alerts.max_alerts_per_user} prices for each warrior. Remove one first.")
+        self.alerts.save()
+
+        embed = discord.Embed(
+            title=f"Alert #{alert.alert_id} Set",
+            description=f"De Zulu will call you when {name} ({symbol}) goes {direction} {self.format_price(threshold)}. "
+                f"It is at {self.format_price(price)} now.",
+            color=discord.Color.green()
+        )
+        embed.set_footer(text=self.footer)
+        return embed
+
+    def remove_alert(self, alert_id, user_id):
+        """remove user's price alert, returns embed describing result"""
+        alert = self.alerts.remove(alert_id, user_id)
+        if not alert:
+            return self.create_error_embed("Alert Not Found", f"You have no alert #{alert_id}.")
+        self.alerts.save()
+        return discord.Embed(
+            title=f"Alert #{alert_id} Removed",
+            description=f"De Zulu will no longer watch {alert.name} ({alert.symbol}) for you.",
+            color=discord.Color.blue()
+        )
+
+    def create_alerts_embed(self, guild_id, user_id):
+        """create embed listing user's active alerts in guild"""
+        alerts = self.alerts.user_alerts(guild_id, user_id)
+        if not alerts:
+            description = "You have no alerts. De Zulu is resting."
+        else:
+            description = "\n".join(f"#{alert.alert_id}: {alert.name} ({alert.symbol}) {alert.direction} "
+                f"{self.format_price(alert.threshold)}" for alert in alerts)
+        embed = discord.Embed(title="Yoh Price Alerts", description=description, color=discord.Color.gold())
+        embed.set_footer(text=self.footer)
+        return embed
+
+    def format_price(self, price):
+        """format usd price, keeping significant digits for coins worth under a dollar"""
+        return f"${price:,.2f}" if price >= 1 else f"${price:.6g}"
+
     def parse_single_coin(self, coin_data, coin_metadata):
         """parse single coin data from api responses"""
         # extract general data
@@ -190,7 +487,7 @@ class CryptoClient:
 
         return parsed_data
     
-    def create_coin_embed(self, coin):
+    def create_coin_embed(self, coin, has_chart=False):
         """create embed for specific coin"""
         symbol = coin['symbol']
         name = coin['name']
@@ -231,6 +528,10 @@ class CryptoClient:
         cmc_url = f"https://coinmarketcap.com/currencies/{slug}/"
         embed.add_field(name="\u200b", value=f"[View de full coin profile]({cmc_url})", inline=False)
 
+        # show attached price chart
+        if has_chart:
+            embed.set_image(url=f"attachment://{self.chart_filename}")
+
         embed.set_footer(text=self.footer)
         return embed
     
@@ -272,8 +573,8 @@ class CryptoClient:
         )
         return embed
     
-    def check_response_code(self, response, func_name):
+    def check_response_code(self, status, text, func_name):
         """check response status code and raise exception if not 200"""
-        if response.status_code != 200:
-            error_msg = f"API returned status code {response.status_code}: {response.text}"
+        if status != 200:
+            error_msg = f"API returned status code {status}: {text}"
             print(f"Error in {func_name}: {error_msg}")
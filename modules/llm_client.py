@@ -1,14 +1,15 @@
 # modules/llm_client.py
 import os
+import time
 import random
-import base64
-import tempfile
-import uuid
+import asyncio
+import hashlib
 from PIL import Image
 from google import genai
 from io import BytesIO
 from google.genai import types
 from dotenv import load_dotenv
+from modules.utils import normalize_text, estimate_tokens, TTLCache
 class LLMClient:
     def __init__(self):
         load_dotenv()
@@ -16,63 +17,234 @@ class LLMClient:
         self.client = genai.Client(api_key=api_key)
         self.text_model = "gemini-2.5-flash"
         self.image_model = "gemini-2.0-flash-preview-image-generation"
+
+        # max requests in flight per model (extra requests wait their turn instead of piling onto api)
+        self.max_concurrency = {
+            self.text_model: 8,
+            self.image_model: 2,
+        }
+        self.semaphores = {model: asyncio.Semaphore(limit) for model, limit in self.max_concurrency.items()}
+
+        # seconds before a request is given up on
+        self.text_timeout = 30
+        self.image_timeout = 60
+
+        # answers to repeated prompts (greetings, memes) keyed by model, persona context and normalized message
+        self.response_cache = TTLCache(max_entries=500, ttl=6 * 3600)
+
+        # generated images keyed by model, persona context and normalized prompt (kept small, images are large)
+        self.image_cache = TTLCache(max_entries=32, ttl=24 * 3600)
+
+        # persona contexts are sent as system instruction, long ones cached provider-side per persona
+        self.context_caches = {}            # (model, context hash) -> {"name", "expires_at"}
+        self.context_cache_locks = {}
+        self.context_cache_ttl = 3600       # seconds a provider-side cache lives
+        self.context_cache_refresh = 300    # extend cache this many seconds before it expires
+        self.min_cache_tokens = 1024        # gemini won't cache shorter contents
+
+    def _cache_key(self, model, context, message, history=""):
+        """build response cache key (context and history hashed, they can be long)"""
+        context_hash = hashlib.sha1((history + context).encode('utf-8')).hexdigest()
+        return (model, context_hash, normalize_text(message))
+
+    def _cached_response(self, key):
+        """look up cached response and log hit rate"""
+        response = self.response_cache.get(key)
+        if response is not None:
+            print(f"LLM cache hit (hit rate {self.response_cache.stats()['hit_rate']:.0%})")
+        return response
+
+    def is_cached(self, message, context, history=""):
+        """check if answer to message can be served from response cache without calling model"""
+        return self.response_cache.contains(self._cache_key(self.text_model, context, message, history))
+
+    def is_image_cached(self, message, context):
+        """check if image for message can be served from image cache without calling model"""
+        return self.image_cache.contains(self._cache_key(self.image_model, context, message))
+
+    def cache_stats(self):
+        """get response cache size and hit/miss counters"""
+        return self.response_cache.stats()
+
+    async def _call_model(self, model, contents, config, timeout):
+        """call gemini through async client, limited per model and cancelled after timeout"""
+        async with self.semaphores[model]:
+            return await asyncio.wait_for(
+                self.client.aio.models.generate_content(model=model, contents=contents, config=config),
+                timeout,
+            )
     
-    def generate_response(self, message, context, error_messages):
-        """generate response from llm using zulu warrior persona"""
+    async def _persona_config(self, model, context, **config):
+        """build generate config with persona context as system instruction (or its provider-side cache)"""
+        cache_name = await self._get_context_cache(model, context)
+        if cache_name:
+            return types.GenerateContentConfig(cached_content=cache_name, **config)
+        return types.GenerateContentConfig(system_instruction=context or None, **config)
+
+    async def _get_context_cache(self, model, context):
+        """get name of provider-side cache holding persona context, creating or extending it as needed"""
+        # short personas aren't worth (or allowed) caching
+        if not context or estimate_tokens(context) < self.min_cache_tokens:
+            return None
+        
+        key = (model, hashlib.sha1(context.encode('utf-8')).hexdigest())
+        lock = self.context_cache_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self.context_caches.get(key)
+            now = time.time()
+            if entry and entry["expires_at"] - self.context_cache_refresh > now:
+                return entry["name"]
+            
+            try:
+                if entry and entry["name"] and entry["expires_at"] > now:
+                    # about to expire, extend it
+                    await self.client.aio.caches.update(
+                        name=entry["name"],
+                        config=types.UpdateCachedContentConfig(ttl=f"{self.context_cache_ttl}s"),
+                    )
+                    name = entry["name"]
+                else:
+                    cached_content = await self.client.aio.caches.create(
+                        model=model,
+                        config=types.CreateCachedContentConfig(
+                            system_instruction=context,
+                            display_name=f"zulubot-persona-{key[1][:12]}",
+                            ttl=f"{self.context_cache_ttl}s",
+                        ),
+                    )
+                    name = cached_content.name
+                self.context_caches[key] = {"name": name, "expires_at": now + self.context_cache_ttl}
+                return name
+            
+            except Exception as e:
+                # use plain system instruction, retry caching once refresh window comes around
+                print(f"Error caching persona context: {e}")
+                self.context_caches[key] = {"name": None, "expires_at": now + 2 * self.context_cache_refresh}
+                return None
+
+    async def stream_response(self, message, context, error_messages, use_cache=True, history=""):
+        """generate response from llm as async iterator of text chunks"""
+        cache_key = self._cache_key(self.text_model, context, message, history)
+        if use_cache:
+            cached = self._cached_response(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        chunks_received = []
+        completed = False
         try:
-            # combine context with message
-            full_prompt = context + message
-
-            # config to disable safety settings         
-            safety_settings=[
-                types.SafetySetting(
-                    category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                ),
-                types.SafetySetting(
-                    category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
-                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                ),
-                types.SafetySetting(
-                    category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                ),
-                types.SafetySetting(
-                    category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
+            # persona context goes in system instruction, conversation history in front of message
+            full_prompt = history + message
+            config = await self._persona_config(self.text_model, context, safety_settings=self._safety_settings())
+
+            async with self.semaphores[self.text_model]:
+                stream = await asyncio.wait_for(
+                    self.client.aio.models.generate_content_stream(
+                        model=self.text_model,
+                        contents=full_prompt,
+                        config=config,
+                    ),
+                    self.text_timeout,
+                )
+                chunks = stream.__aiter__()
+                while True:
+                    # timeout applies to gap between chunks, long answers may stream for a while
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), self.text_timeout)
+                    except StopAsyncIteration:
+                        break
+                    if chunk.text:
+                        chunks_received.append(chunk.text)
+                        yield chunk.text
+                completed = True
+
+        except asyncio.TimeoutError:
+            print("LLM response timed out")
+        except Exception as e:
+            print(f"Error from LLM: {e}")
+        
+        # nothing came through, answer with error message instead
+        if not chunks_received:
+            yield random.choice(error_messages)
+        # only cache answers that streamed through completely
+        elif completed and use_cache:
+            self.response_cache.put(cache_key, "".join(chunks_received))
+
+    async def summarize(self, previous_summary, transcript, max_tokens):
+        """fold transcript of older turns into running conversation summary"""
+        prompt = (
+            "Update the running summary of a chat conversation with the new turns below. "
+            f"Keep names, facts, requests and open questions. Reply with the summary only, under {max_tokens} tokens.\n\n"
+            f"Current summary: {previous_summary or '(none)'}\n\n"
+            f"New turns:\n{transcript}"
+        )
+        try:
+            response = await self._call_model(
+                self.text_model,
+                prompt,
+                types.GenerateContentConfig(
+                    safety_settings=self._safety_settings(),
+                    max_output_tokens=max_tokens,
+                    # thinking tokens count towards max_output_tokens and would leave summary truncated or empty
+                    thinking_config=types.ThinkingConfig(thinking_budget=0),
                 ),
-            ]
-            
-            response = self.client.models.generate_content(
-                model=self.text_model,
-                contents=full_prompt,
-                config=types.GenerateContentConfig(safety_settings=safety_settings),
+                self.text_timeout,
             )
             return response.text
-            
         except Exception as e:
-            print(f"Error from LLM: {e}")
-            return random.choice(error_messages)
+            print(f"Error summarizing conversation: {e}")
+            return None
+
+    def _safety_settings(self):
+        """config to disable safety settings"""
+        return [
+            types.SafetySetting(
+                category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+                threshold=types.HarmBlockThreshold.BLOCK_NONE,
+            ),
+            types.SafetySetting(
+                category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
+                threshold=types.HarmBlockThreshold.BLOCK_NONE,
+            ),
+            types.SafetySetting(
+                category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+                threshold=types.HarmBlockThreshold.BLOCK_NONE,
+            ),
+            types.SafetySetting(
+                category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+                threshold=types.HarmBlockThreshold.BLOCK_NONE,
+            ),
+        ]
+
+    async def generate_image(self, message, context, error_messages):
+        """generate image from llm, returns (text_response, image_bytes, extension) or error message
         
+        extension is None if image isn't png/jpeg and needs re-encoding before upload
+        """
+        # repeat draws of same prompt and persona are served from memory
+        cache_key = self._cache_key(self.image_model, context, message)
+        cached = self.image_cache.get(cache_key)
+        if cached is not None:
+            print("Image cache hit")
+            return cached
 
-    def generate_image(self, message, context, error_messages):
-        """generate image from llm"""
         try:
             prompt = ('Please generate an image based on the following description: ')
 
-            # combine context with message
+            # combine context with message (image model doesn't accept system instructions)
             full_prompt = context + prompt + message
 
-            response = self.client.models.generate_content(
-                model= self.image_model,
-                contents=full_prompt,
-                config=types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE']
-                )
+            response = await self._call_model(
+                self.image_model,
+                full_prompt,
+                types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE']),
+                self.image_timeout,
             )
 
             text_response = None
-            image_path = None
+            image_data = None
+            extension = None
 
             # parse response parts
             for part in response.candidates[0].content.parts:
@@ -80,22 +252,48 @@ class LLMClient:
                     text_response = part.text
                     print("Generated text:", part.text)
                 elif part.inline_data is not None:
-                    # create temp file with unique name
-                    temp_dir = tempfile.gettempdir()
-                    image_filename = f"zuludraw_image_{uuid.uuid4().hex}.png"
-                    image_path = os.path.join(temp_dir, image_filename)
-                    
-                    # save image to temp file
-                    image = Image.open(BytesIO(part.inline_data.data))
-                    image.save(image_path)
-                    print(f"image saved to: {image_path}")
+                    # keep raw bytes, no decoding needed if discord can show them as they are
+                    image_data = part.inline_data.data
+                    extension = self._image_extension(image_data)
+                    print(f"Generated image: {len(image_data)} bytes ({part.inline_data.mime_type})")
                 
-            # return both text and image path
-            if text_response and image_path:
-                return (text_response, image_path)
+            # return both text and image
+            if text_response and image_data:
+                result = (text_response, image_data, extension)
+                self.image_cache.put(cache_key, result)
+                return result
             else:
                 return random.choice(error_messages)
 
+        except asyncio.TimeoutError:
+            print("LLM image generation timed out")
+            return random.choice(error_messages)
         except Exception as e:
             print(f"Error from LLM: {e}")
-            return random.choice(error_messages)
\ No newline at end of file
+            return random.choice(error_messages)
+
+    def _image_extension(self, data):
+        """get file extension from image magic bytes (png/jpeg only)"""
+        if data.startswith(b'\x89PNG\r\n\x1a\n'):
+            return "png"
+        if data.startswith(b'\xff\xd8\xff'):
+            return "jpg"
+        return None
+
+    def fit_image(self, data, max_bytes):
+        """re-encode image as png, downscaling to jpeg until it fits under max_bytes (blocking, run in thread)"""
+        image = Image.open(BytesIO(data))
+
+        buffer = BytesIO()
+        image.save(buffer, format="PNG", optimize=True)
+        if buffer.tell() <= max_bytes:
+            return buffer.getvalue(), "png"
+        
+        # shrink until it fits
+        image = image.convert("RGB")
+        while True:
+            buffer = BytesIO()
+            image.save(buffer, format="JPEG", quality=85)
+            if buffer.tell() <= max_bytes or min(image.size) < 64:
+                return buffer.getvalue(), "jpg"
+            image = image.resize((int(image.width * 0.75), int(image.height * 0.75)), Image.LANCZOS)
@@ -0,0 +1,28 @@
+# modules/market_snapshot.py
+import time
+from types import MappingProxyType
+
+class MarketSnapshot:
+    """immutable view of latest listings for top coins, replaced wholesale on each refresh"""
+    __slots__ = ("coins", "ranked", "fetched_at")
+
+    def __init__(self, listings, fetched_at=None):
+        ranked = tuple(coin for coin in listings if isinstance(coin.get("id"), int))
+        object.__setattr__(self, "ranked", ranked)     # coin data in market cap order
+        object.__setattr__(self, "coins", MappingProxyType({coin["id"]: coin for coin in ranked}))
+        object.__setattr__(self, "fetched_at", fetched_at if fetched_at is not None else time.time())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MarketSnapshot is immutable")
+
+    def __len__(self):
+        return len(self.ranked)
+
+    def get(self, coin_id):
+        return self.coins.get(coin_id)
+
+    def top(self, limit):
+        return self.ranked[:limit]
+
+    def age(self):
+        return time.time() - self.fetched_at
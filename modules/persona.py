@@ -10,6 +10,7 @@ class Persona:
         self.name = ""
         self.context = ""
         self.voice_id = ""
+        self.cache_responses = True     # False for "fresh" personas that should never repeat an answer
         
         # load personas from json file
         try:
@@ -53,6 +54,7 @@ class Persona:
             self.name = persona_obj["name"]
             self.context = persona_obj["context"]
             self.voice_id = persona_obj["voice_id"]
+            self.cache_responses = not persona_obj.get("fresh", False)
             return f"De Zulu has set de persona to: {self.name}"
         return "De Zulu does not recognize dis persona. Use **!zulupersonas** to see de list of valid personas."
     
@@ -0,0 +1,142 @@
+# modules/price_alerts.py
+import os
+import json
+import time
+import bisect
+import threading
+from modules.utils import save_json_atomic
+
+ABOVE = "above"
+BELOW = "below"
+
+class PriceAlert:
+    """user request to be pinged when coin price crosses threshold"""
+    __slots__ = ("alert_id", "coin_id", "name", "symbol", "direction", "threshold",
+        "guild_id", "channel_id", "user_id", "created_at")
+
+    def __init__(self, alert_id, coin_id, name, symbol, direction, threshold, guild_id, channel_id, user_id, created_at=None):
+        self.alert_id = alert_id
+        self.coin_id = coin_id
+        self.name = name
+        self.symbol = symbol
+        self.direction = direction
+        self.threshold = threshold
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.user_id = user_id
+        self.created_at = created_at or time.time()
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+class AlertEngine:
+    """price alerts kept sorted by threshold per coin, so each poll only touches crossed thresholds"""
+    def __init__(self, cache_path="cache/price_alerts.json", max_alerts_per_user=10):
+        self.cache_path = cache_path    # set to None to keep alerts in memory only
+        self.max_alerts_per_user = max_alerts_per_user
+        self.alerts = {}                # alert id -> PriceAlert
+        self.above = {}                 # coin id -> sorted [(threshold, alert id)], fire when price rises to threshold
+        self.below = {}                 # coin id -> sorted [(threshold, alert id)], fire when price falls to threshold
+        self.user_counts = {}           # user id -> number of active alerts
+        self.next_id = 1
+        self.lock = threading.Lock()    # saving runs in worker thread
+
+        self.load()
+
+    def add(self, coin_id, name, symbol, direction, threshold, guild_id, channel_id, user_id):
+        """register new alert, returns it or None if user has too many"""
+        if self.user_counts.get(user_id, 0) >= self.max_alerts_per_user:
+            return None
+        alert = PriceAlert(self.next_id, coin_id, name, symbol, direction, threshold, guild_id, channel_id, user_id)
+        self.next_id += 1
+        self._insert(alert)
+        return alert
+
+    def remove(self, alert_id, user_id):
+        """remove user's alert by id, returns removed alert or None"""
+        alert = self.alerts.get(alert_id)
+        if not alert or alert.user_id != user_id:
+            return None
+        self._delete(alert)
+        return alert
+
+    def user_alerts(self, guild_id, user_id):
+        return sorted((alert for alert in self.alerts.values() if alert.user_id == user_id and alert.guild_id == guild_id),
+            key=lambda alert: alert.alert_id)
+
+    def coin_ids(self):
+        """coins that have at least one active alert"""
+        return self.above.keys() | self.below.keys()
+
+    def check(self, prices):
+        """evaluate all alerts against one poll of {coin id: price}, returns triggered alerts (which are removed)"""
+        triggered = []
+        # only visit coins that both have alerts and were polled
+        for coin_id in self.coin_ids() & prices.keys():
+            price = prices[coin_id]
+            if price is None:
+                continue
+
+            # thresholds at or below price have been crossed upwards (a prefix of sorted list)
+            thresholds = self.above.get(coin_id)
+            if thresholds:
+                cut = bisect.bisect_right(thresholds, (price, float('inf')))
+                triggered.extend(self.alerts[alert_id] for _, alert_id in thresholds[:cut])
+
+            # thresholds at or above price have been crossed downwards (a suffix of sorted list)
+            thresholds = self.below.get(coin_id)
+            if thresholds:
+                cut = bisect.bisect_left(thresholds, (price, -1))
+                triggered.extend(self.alerts[alert_id] for _, alert_id in thresholds[cut:])
+
+        for alert in triggered:
+            self._delete(alert)
+        return triggered
+
+    def _insert(self, alert):
+        book = self.above if alert.direction == ABOVE else self.below
+        bisect.insort(book.setdefault(alert.coin_id, []), (alert.threshold, alert.alert_id))
+        with self.lock:
+            self.alerts[alert.alert_id] = alert
+        self.user_counts[alert.user_id] = self.user_counts.get(alert.user_id, 0) + 1
+
+    def _delete(self, alert):
+        book = self.above if alert.direction == ABOVE else self.below
+        thresholds = book.get(alert.coin_id, [])
+        index = bisect.bisect_left(thresholds, (alert.threshold, alert.alert_id))
+        if index < len(thresholds) and thresholds[index][1] == alert.alert_id:
+            del thresholds[index]
+        if not thresholds:
+            book.pop(alert.coin_id, None)
+
+        with self.lock:
+            self.alerts.pop(alert.alert_id, None)
+        self.user_counts[alert.user_id] -= 1
+        if not self.user_counts[alert.user_id]:
+            del self.user_counts[alert.user_id]
+
+    def load(self):
+        """load active alerts from disk"""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for entry in data:
+                alert = PriceAlert(**entry)
+                self._insert(alert)
+                self.next_id = max(self.next_id, alert.alert_id + 1)
+            print(f"Loaded {len(self.alerts)} price alerts")
+        except Exception as e:
+            print(f"Error loading price alerts: {e}")
+
+    def save(self):
+        """write alerts to disk (via temp file so a crash never leaves it half written)"""
+        if not self.cache_path:
+            return
+        try:
+            with self.lock:
+                data = [alert.to_dict() for alert in self.alerts.values()]
+            save_json_atomic(self.cache_path, data)
+        except Exception as e:
+            print(f"Error saving price alerts: {e}")
@@ -0,0 +1,157 @@
+# modules/price_history.py
+import os
+import json
+import mmap
+import time
+import threading
+from io import BytesIO
+from pathlib import Path
+from PIL import Image, ImageDraw
+from modules.utils import save_json_atomic
+
+class PriceHistory:
+    """fixed-size float32 ring buffer of polled prices per coin, optionally memory-mapped to disk"""
+    def __init__(self, max_coins=200, capacity=7 * 24 * 60, data_path="cache/price_history.bin"):
+        self.max_coins = max_coins
+        self.capacity = capacity        # samples kept per coin (a week of one-minute polls by default)
+        self.data_path = data_path      # set to None to keep history in memory only
+        self.index_path = f"{data_path}.json" if data_path else None
+        self.slots = {}                 # coin id -> [slot, head, count, updated_at]
+        self.lock = threading.Lock()    # index is saved from worker thread
+
+        size = max_coins * capacity * 4
+        self.file = None
+        self.buffer = self._open_mmap(size) if data_path else bytearray(size)
+        self.prices = memoryview(self.buffer).cast('f')
+
+        self.load()
+
+    def _open_mmap(self, size):
+        """map data file into memory, falling back to plain memory if that fails"""
+        try:
+            Path(self.data_path).parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.data_path, 'a+b')
+            if os.path.getsize(self.data_path) != size:
+                # layout changed (or new file), start over
+                self.file.truncate(size)
+                if os.path.exists(self.index_path):
+                    os.remove(self.index_path)
+            return mmap.mmap(self.file.fileno(), size)
+        except Exception as e:
+            print(f"Error mapping price history file, keeping it in memory: {e}")
+            self.data_path = self.index_path = None
+            if self.file:
+                self.file.close()
+                self.file = None
+            return bytearray(size)
+
+    def record_many(self, quotes, timestamp=None):
+        """append one polled price per coin from iterable of (coin_id, price)"""
+        timestamp = timestamp or time.time()
+        capacity, prices = self.capacity, self.prices
+        with self.lock:
+            for coin_id, price in quotes:
+                if price is None:
+                    continue
+                entry = self.slots.get(coin_id) or self._claim_slot(coin_id)
+                slot, head, count, _ = entry
+                prices[slot * capacity + head] = price
+                entry[1] = (head + 1) % capacity
+                entry[2] = min(count + 1, capacity)
+                entry[3] = timestamp
+
+    def _claim_slot(self, coin_id):
+        """assign free slot to coin, evicting least recently updated coin if all are taken"""
+        if len(self.slots) < self.max_coins:
+            taken = {entry[0] for entry in self.slots.values()}
+            slot = next(slot for slot in range(self.max_coins) if slot not in taken)
+        else:
+            stale_id = min(self.slots, key=lambda key: self.slots[key][3])
+            slot = self.slots.pop(stale_id)[0]
+        entry = [slot, 0, 0, 0]
+        self.slots[coin_id] = entry
+        return entry
+
+    def series(self, coin_id):
+        """get recorded prices for coin in chronological order"""
+        with self.lock:
+            entry = self.slots.get(coin_id)
+            if not entry:
+                return []
+            slot, head, count, _ = entry
+            start = slot * self.capacity
+            if count < self.capacity:
+                return self.prices[start:start + count].tolist()
+            # buffer wrapped, oldest sample sits at head
+            return self.prices[start + head:start + self.capacity].tolist() + self.prices[start:start + head].tolist()
+
+    def sparkline(self, coin_id, points=120, width=400, height=80):
+        """render price history for coin as png bytes, or None if too little history"""
+        values = downsample(self.series(coin_id), points)
+        if len(values) < 2:
+            return None
+        return render_sparkline(values, width, height)
+
+    def load(self):
+        """load slot index from disk"""
+        if not self.index_path or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("capacity") != self.capacity or data.get("max_coins") != self.max_coins:
+                return
+            with self.lock:
+                self.slots = {int(coin_id): entry for coin_id, entry in data["slots"].items()}
+            print(f"Loaded price history for {len(self.slots)} coins")
+        except Exception as e:
+            print(f"Error loading price history index: {e}")
+
+    def save(self):
+        """flush mapped prices and write slot index (via temp file so a crash never leaves it half written)"""
+        if not self.index_path:
+            return
+        try:
+            with self.lock:
+                data = {
+                    "capacity": self.capacity,
+                    "max_coins": self.max_coins,
+                    "slots": {str(coin_id): list(entry) for coin_id, entry in self.slots.items()},
+                }
+                self.buffer.flush()
+            save_json_atomic(self.index_path, data)
+        except Exception as e:
+            print(f"Error saving price history: {e}")
+
+    def close(self):
+        """save history and unmap data file"""
+        self.save()
+        if self.file:
+            self.prices.release()
+            self.buffer.close()
+            self.file.close()
+            self.file = None
+
+def downsample(values, points):
+    """reduce values to about points samples by averaging evenly sized buckets"""
+    if len(values) <= points:
+        return values
+    step = len(values) / points
+    return [sum(bucket) / len(bucket) for bucket in
+        (values[int(i * step):int((i + 1) * step)] for i in range(points)) if bucket]
+
+def render_sparkline(values, width=400, height=80, padding=4):
+    """draw values as line chart, green if price went up over the period else red"""
+    low, high = min(values), max(values)
+    spread = (high - low) or 1
+    x_scale = (width - 2 * padding) / (len(values) - 1)
+    y_scale = (height - 2 * padding) / spread
+    line = [(padding + i * x_scale, height - padding - (value - low) * y_scale) for i, value in enumerate(values)]
+
+    color = (22, 199, 132) if values[-1] >= values[0] else (234, 57, 67)
+    image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    ImageDraw.Draw(image).line(line, fill=color, width=2, joint="curve")
+
+    output = BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
@@ -0,0 +1,187 @@
+# modules/scheduler.py
+import time
+import heapq
+import asyncio
+from collections import Counter
+
+class SchedulerOverloaded(Exception):
+    """raised when a request is rejected instead of queued"""
+
+class TokenBucket:
+    """refills rate tokens per second up to capacity"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, amount=1.0):
+        """take tokens if available"""
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def wait_time(self, amount=1.0):
+        """seconds until amount tokens are available"""
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+class BackendScheduler:
+    """two-level weighted fair queue in front of one backend (gemini, elevenlabs, ...)
+    
+    guilds share the backend by guild weight, and users inside a guild share their guild's turns
+    equally. requests are started in order of virtual finish time at both levels, so a user
+    spamming commands only delays their own requests and a busy guild can't crowd out a quiet one.
+    """
+    def __init__(self, name, max_concurrency=4, rate=1.0, burst=5, max_pending=50, max_pending_per_user=3):
+        self.name = name
+        self.max_concurrency = max_concurrency      # global cap on requests in flight
+        self.bucket = TokenBucket(rate, burst)      # global request rate limit (requests spend their cost)
+        self.max_pending = max_pending              # waiting requests before new ones are rejected
+        self.max_pending_per_user = max_pending_per_user
+        self.guild_weights = {}                     # guild id -> weight (default 1.0)
+
+        self.guilds = {}                # guild id -> {"heap", "tag", "virtual_time", "last_finish"} while it has waiting requests
+        self.seq = 0
+        self.virtual_time = 0.0         # guild level virtual time
+        self.guild_finish = {}          # guild id -> guild level finish tag of its latest started request
+        self.pending = Counter()        # flow -> waiting requests
+        self.waiting = 0
+        self.running = 0
+        self.wakeup = None              # timer handle while waiting for rate limit tokens
+        self.rejected = 0
+
+    async def submit(self, guild_id, user_id, coro_factory, cost=1.0):
+        """wait for fair turn, then run coro_factory() and return its result"""
+        flow = (guild_id, user_id)
+        if self.waiting >= self.max_pending or self.pending[flow] >= self.max_pending_per_user:
+            self.rejected += 1
+            raise SchedulerOverloaded(f"{self.name} scheduler is overloaded")
+
+        # user level tag, every user in guild has an equal share
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            # guild became backlogged, its turn is tagged from current virtual time
+            weight = self.guild_weights.get(guild_id, 1.0)
+            guild_tag = max(self.virtual_time, self.guild_finish.get(guild_id, 0.0)) + cost / weight
+            guild = self.guilds[guild_id] = {"heap": [], "tag": guild_tag, "virtual_time": 0.0, "last_finish": {}}
+        finish_tag = max(guild["virtual_time"], guild["last_finish"].get(user_id, 0.0)) + cost
+        guild["last_finish"][user_id] = finish_tag
+
+        future = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        heapq.heappush(guild["heap"], (finish_tag, self.seq, future, flow, cost))
+        self.pending[flow] += 1
+        self.waiting += 1
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                # abandoned while waiting, stop counting it against limits right away
+                # (its cancelled future marks heap entry as already counted, dispatcher just discards it)
+                self._take_waiting(flow)
+                self._forget_flow(flow)
+            else:
+                # turn was already granted, hand it on
+                self.running -= 1
+                self._forget_flow(flow)
+                self._dispatch()
+            raise
+
+        try:
+            return await coro_factory()
+        finally:
+            self.running -= 1
+            self._forget_flow(flow)
+            self._dispatch()
+
+    def stats(self):
+        """get queue depth, requests in flight and rejection count"""
+        return {
+            "waiting": self.waiting,
+            "running": self.running,
+            "rejected": self.rejected,
+        }
+
+    def _dispatch(self):
+        """start waiting requests while under concurrency cap and rate limit"""
+        while self.running < self.max_concurrency:
+            choice = self._next_guild()
+            if choice is None:
+                return
+            guild_id = choice
+            guild = self.guilds[guild_id]
+            guild_tag = guild["tag"]
+            finish_tag, _, future, flow, cost = guild["heap"][0]
+
+            # expensive requests (e.g. images) spend more tokens, capped so they can still run
+            tokens = min(cost, self.bucket.capacity)
+            if not self.bucket.try_take(tokens):
+                # out of tokens, come back when enough are available
+                if self.wakeup is None:
+                    loop = asyncio.get_running_loop()
+                    self.wakeup = loop.call_later(self.bucket.wait_time(tokens), self._wake)
+                return
+            
+            heapq.heappop(guild["heap"])
+            self._take_waiting(flow)
+            guild["virtual_time"] = max(guild["virtual_time"], finish_tag)
+            self.guild_finish[guild_id] = guild_tag
+            self.virtual_time = max(self.virtual_time, guild_tag)
+            if guild["heap"]:
+                # guild's next turn follows on from this one
+                next_cost = guild["heap"][0][4]
+                guild["tag"] = guild_tag + next_cost / self.guild_weights.get(guild_id, 1.0)
+            self._forget_guild(guild_id)
+            self.running += 1
+            future.set_result(True)
+
+    def _next_guild(self):
+        """pick guild whose next request has lowest guild level finish tag, returns guild id or None"""
+        best = None
+        for guild_id in list(self.guilds):
+            heap = self.guilds[guild_id]["heap"]
+            # discard waiters that were cancelled (submit has already stopped counting them)
+            while heap and heap[0][2].cancelled():
+                heapq.heappop(heap)
+            if not heap:
+                self._forget_guild(guild_id)
+                continue
+            
+            key = (self.guilds[guild_id]["tag"], heap[0][1])
+            if best is None or key < best[0]:
+                best = (key, guild_id)
+        return best[1] if best else None
+
+    def _take_waiting(self, flow):
+        """count request of flow as no longer waiting"""
+        self.pending[flow] -= 1
+        self.waiting -= 1
+
+    def _wake(self):
+        """rate limit timer fired"""
+        self.wakeup = None
+        self._dispatch()
+
+    def _forget_flow(self, flow):
+        """drop flow's waiting count once nothing of it is waiting"""
+        if self.pending[flow] <= 0:
+            self.pending.pop(flow, None)
+
+    def _forget_guild(self, guild_id):
+        """drop guild's queue once nothing in it is waiting (its users start level again next time)"""
+        guild = self.guilds.get(guild_id)
+        if guild is None or guild["heap"]:
+            return
+        del self.guilds[guild_id]
+        if self.guild_finish.get(guild_id, 0.0) <= self.virtual_time:
+            self.guild_finish.pop(guild_id, None)
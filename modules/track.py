@@ -0,0 +1,63 @@
+# modules/track.py
+
+# kinds of audio a track can hold
+STREAM = "stream"       # remote stream url (youtube)
+FILE = "file"           # local audio file
+MEMORY = "memory"       # in-memory audio stream (tts chunks)
+
+# resolution states for tracks queued by search term or url
+PENDING = "pending"     # not resolved yet
+RESOLVING = "resolving" # resolution running in background
+READY = "ready"         # source is playable
+FAILED = "failed"       # could not be resolved
+
+class Track:
+    """single queued or playing audio item (slots keep large playlists cheap in memory)"""
+    __slots__ = ("source", "title", "kind", "duration", "requester", "query", "state", "resolve_task", "announce", "group")
+
+    def __init__(self, source, title, kind, duration=None, requester=None, query=None, announce=True, group=None):
+        self.source = source
+        self.title = title
+        self.kind = kind
+        self.duration = duration            # seconds, if known
+        self.requester = requester          # discord user id of whoever queued track
+        self.query = query                  # search term or url still to be resolved
+        self.state = PENDING if query and not source else READY
+        self.resolve_task = None
+        self.announce = announce            # post "now playing" message when track starts from queue
+        self.group = group                  # shared by segments of one spoken answer, skipped together
+
+    @classmethod
+    def from_source(cls, source, title, is_stream=False, **kwargs):
+        """create track, working out its kind from source"""
+        if is_stream:
+            kind = STREAM
+        elif hasattr(source, 'read'):
+            kind = MEMORY
+        else:
+            kind = FILE
+        return cls(source, title, kind, **kwargs)
+
+    @property
+    def is_stream(self):
+        return self.kind == STREAM
+
+    @property
+    def is_file(self):
+        return self.kind == FILE
+
+    @property
+    def needs_resolve(self):
+        return self.state in (PENDING, RESOLVING)
+
+    def __repr__(self):
+        return f"Track({self.title!r}, kind={self.kind}, state={self.state})"
+
+def format_duration(seconds):
+    """format seconds as m:ss or h:mm:ss"""
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
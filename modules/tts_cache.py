@@ -0,0 +1,150 @@
+# modules/tts_cache.py
+import os
+import json
+import time
+import asyncio
+import hashlib
+import aiofiles
+from collections import OrderedDict, Counter
+from pathlib import Path
+from modules.utils import save_json_atomic
+
+class ClipCache:
+    def __init__(self, cache_dir="cache/tts", max_bytes=200 * 1024 * 1024):
+        # clips are evicted only by this cache, playback never deletes them
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # key -> {"file", "size", "last_used"}, least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.pins = Counter()           # key -> clips handed out by get() and not yet released (never evicted)
+        self.save_delay = 5             # seconds, index writes are batched
+        self.save_task = None
+
+        Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+        self.load()
+
+    @staticmethod
+    def make_key(voice_id, model, text):
+        """hash of voice, model and whitespace-normalized text"""
+        normalized = ' '.join(text.split())
+        return hashlib.sha256(f"{voice_id}\0{model}\0{normalized}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """get path of cached clip, or None if not cached
+        
+        clip is pinned against eviction until path is passed to release()
+        """
+        entry = self.entries.get(key)
+        if not entry:
+            self.misses += 1
+            return None
+        
+        file_path = os.path.join(self.cache_dir, entry["file"])
+        if not os.path.exists(file_path):
+            # file removed behind our back, forget it
+            self._drop(key)
+            self.misses += 1
+            return None
+        
+        # mark as most recently used
+        entry["last_used"] = time.time()
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self.pins[key] += 1
+        self.schedule_save()
+        return file_path
+
+    def release(self, file_path):
+        """unpin clip handed out by get() once it has played (or was dropped)"""
+        key = os.path.splitext(os.path.basename(file_path))[0]
+        self.pins[key] -= 1
+        if self.pins[key] <= 0:
+            del self.pins[key]
+
+    async def put(self, key, data):
+        """write clip to cache and evict least recently used clips over byte budget"""
+        if len(data) > self.max_bytes:
+            return None
+        
+        file_name = f"{key}.mp3"
+        file_path = os.path.join(self.cache_dir, file_name)
+        async with aiofiles.open(file_path, "wb") as f:
+            await f.write(data)
+        
+        if key in self.entries:
+            self._drop(key, remove_file=False)
+        self.entries[key] = {"file": file_name, "size": len(data), "last_used": time.time()}
+        self.total_bytes += len(data)
+
+        # evict least recently used clips, skipping ones still queued or playing
+        for old_key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if old_key != key and old_key not in self.pins:
+                self._drop(old_key)
+        
+        self.schedule_save()
+        return file_path
+
+    def load(self):
+        """load index and remove clips missing from it (or index entries missing their clip)"""
+        try:
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                
+                # rebuild in lru order
+                for key, entry in sorted(data.items(), key=lambda item: item[1].get("last_used", 0)):
+                    if os.path.exists(os.path.join(self.cache_dir, entry["file"])):
+                        self.entries[key] = entry
+                        self.total_bytes += entry["size"]
+            
+            # delete orphaned clips (e.g. written before a crash, never indexed)
+            indexed_files = {entry["file"] for entry in self.entries.values()}
+            for file in os.listdir(self.cache_dir):
+                if file.endswith(".mp3") and file not in indexed_files:
+                    os.remove(os.path.join(self.cache_dir, file))
+            
+            print(f"Loaded {len(self.entries)} cached TTS clips ({self.total_bytes / 1024 / 1024:.1f} MB)")
+        except Exception as e:
+            print(f"Error loading TTS clip cache: {e}")
+
+    def schedule_save(self):
+        """save index shortly, off the event loop (changes in the meantime go out in the same write)"""
+        if self.save_task is None or self.save_task.done():
+            self.save_task = asyncio.create_task(self._delayed_save())
+
+    async def _delayed_save(self):
+        await asyncio.sleep(self.save_delay)
+        # copy on the loop, write in worker thread
+        data = {key: dict(entry) for key, entry in self.entries.items()}
+        await asyncio.to_thread(self.save, data)
+
+    def save(self, data=None):
+        """write index to disk (via temp file so a crash never leaves it half written)"""
+        try:
+            save_json_atomic(self.index_path, self.entries if data is None else data)
+        except Exception as e:
+            print(f"Error saving TTS clip cache index: {e}")
+
+    def stats(self):
+        """get size and hit/miss counters"""
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _drop(self, key, remove_file=True):
+        """remove entry from index (and its clip from disk)"""
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry["size"]
+        if remove_file:
+            try:
+                os.remove(os.path.join(self.cache_dir, entry["file"]))
+            except OSError:
+                pass
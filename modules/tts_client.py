@@ -1,23 +1,81 @@
 # modules/tts_client.py
 import os
-import uuid
-import aiofiles
+import queue
+import asyncio
 from elevenlabs.client import AsyncElevenLabs
 from dotenv import load_dotenv
-from pathlib import Path
+from modules.tts_cache import ClipCache
+
+class AudioChunkStream:
+    """file-like buffer fed with tts chunks, read by ffmpeg's stdin writer thread while chunks still arrive"""
+    def __init__(self):
+        self.chunks = queue.Queue()     # thread-safe handoff from event loop to ffmpeg writer thread
+        self.buffer = b""
+        self.finished = False
+        self.pump_task = None           # background task still receiving chunks from elevenlabs
+
+    def feed(self, chunk):
+        """add chunk of audio (called from event loop)"""
+        self.chunks.put(chunk)
+
+    def close(self):
+        """mark end of audio so reader gets eof"""
+        self.chunks.put(None)
+
+    def read(self, size=-1):
+        """read up to size bytes, blocking until data arrives (b"" means end of audio)"""
+        # wait for at least some data unless stream is finished
+        while not self.buffer and not self.finished:
+            self._take(block=True)
+        
+        # grab whatever else has already arrived without blocking
+        while not self.chunks.empty() and (size < 0 or len(self.buffer) < size):
+            self._take(block=False)
+
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def _take(self, block):
+        """move one chunk from queue to buffer"""
+        try:
+            chunk = self.chunks.get(block=block)
+        except queue.Empty:
+            return
+        if chunk is None:
+            self.finished = True
+        else:
+            self.buffer += chunk
 
 class TTSClient:
-    def __init__(self): # default zulu warrior voice id
+    def __init__(self, max_streams=3, chunk_timeout=15):
         load_dotenv()
         api_key = os.getenv("ELEVENLABS_API_KEY")
         self.client = AsyncElevenLabs(api_key=api_key)
-        
-        # create download directory if nonexistent
-        self.download_dir = "downloads"
-        Path(self.download_dir).mkdir(exist_ok=True)
+
+        # elevenlabs model used for speech (None = api default), part of clip cache key
+        self.model = None
+
+        # synthesized clips reused for repeated text in same voice
+        self.clip_cache = ClipCache()
+
+        # elevenlabs rejects concurrent requests over plan limit, so streams are capped across all requests
+        # (a slot is held until whole clip has streamed in)
+        self.synthesis_slots = asyncio.Semaphore(max_streams)
+        self.chunk_timeout = chunk_timeout      # seconds without a chunk before stream is abandoned
     
-    async def generate_speech(self, text, voice_id):
-        """generate speech from text and save to temporary file"""
+    async def stream_speech(self, text, voice_id):
+        """generate speech from text as in-memory stream that playback can start on right away
+        
+        returns path of cached clip instead if same text was already spoken in this voice
+        """
+        cache_key = ClipCache.make_key(voice_id, self.model or "default", text)
+        cached_path = self.clip_cache.get(cache_key)
+        if cached_path:
+            return cached_path
+
+        await self.synthesis_slots.acquire()
         try:
             # elevenlabs sends back audio as stream of chunks
             stream = await self.client.generate(
@@ -26,18 +84,71 @@ class TTSClient:
                 # model="eleven_multilingual_v2",
                 stream=True
             )
+            chunks = stream.__aiter__()
+
+            # wait for first chunk so api errors are reported here rather than mid-playback
+            first_chunk = await asyncio.wait_for(chunks.__anext__(), self.chunk_timeout)
             
-            # give sound file random uuid filename in downloads folder
-            file_name = f"output_{uuid.uuid4()}.mp3"
-            file_path = os.path.join(self.download_dir, file_name)
-            
-            # asynchronously open file and write to it chunk by chunk
-            async with aiofiles.open(file_path, "wb") as f:
-                async for chunk in stream:
-                    await f.write(chunk)
-                    
-            return file_path
-            
-        except Exception as e:
+        except BaseException as e:
+            self.synthesis_slots.release()
+            if not isinstance(e, Exception):
+                raise
             print(f"Error generating TTS: {e}")
-            return None
\ No newline at end of file
+            return None
+
+        audio_stream = AudioChunkStream()
+        audio_stream.feed(first_chunk)
+
+        # keep feeding rest of chunks in background while audio plays (or waits in queue),
+        # slot is freed once stream ends however pump finishes (even if cancelled before it started)
+        audio_stream.pump_task = asyncio.create_task(self._pump_chunks(chunks, audio_stream, cache_key, first_chunk))
+        audio_stream.pump_task.add_done_callback(lambda _: self._end_stream(audio_stream))
+        return audio_stream
+
+    def _end_stream(self, audio_stream):
+        """free synthesis slot of finished stream and make sure reader gets eof"""
+        self.synthesis_slots.release()
+        audio_stream.close()
+
+    def synthesize_segments(self, segments, voice_id):
+        """start synthesizing segments concurrently (limited by shared synthesis slots, in order)
+        
+        returns one task per segment giving what stream_speech gives
+        """
+        return [asyncio.create_task(self.stream_speech(segment, voice_id)) for segment in segments]
+
+    async def wait_synthesized(self, sources):
+        """wait until speech has fully streamed in (tasks from synthesize_segments or stream_speech results)"""
+        for source in sources:
+            if isinstance(source, asyncio.Future):
+                await asyncio.wait({source})
+                # segment dropped from queue or failed, nothing left streaming
+                if source.cancelled() or source.exception():
+                    continue
+                source = source.result()
+            if isinstance(source, AudioChunkStream) and source.pump_task:
+                await asyncio.wait({source.pump_task})
+
+    async def _pump_chunks(self, chunks, audio_stream, cache_key, first_chunk):
+        """move remaining tts chunks into audio stream, then cache complete clip"""
+        clip_data = bytearray(first_chunk)
+        try:
+            while True:
+                try:
+                    # stalled stream would otherwise hold its synthesis slot forever
+                    chunk = await asyncio.wait_for(chunks.__anext__(), self.chunk_timeout)
+                except StopAsyncIteration:
+                    break
+                audio_stream.feed(chunk)
+                clip_data.extend(chunk)
+        except Exception as e:
+            # don't cache partial clips
+            print(f"Error streaming TTS: {e}")
+            return
+        finally:
+            audio_stream.close()
+
+        try:
+            await self.clip_cache.put(cache_key, bytes(clip_data))
+        except Exception as e:
+            print(f"Error caching TTS clip: {e}")
\ No newline at end of file
@@ -1,5 +1,10 @@
 # modules/utils.py
+import os
 import re
+import json
+import time
+from pathlib import Path
+from collections import OrderedDict
 
 def split_text(text, max_chars=2000):
     """split text into sections under max_chars"""
@@ -15,21 +20,7 @@ def split_text(text, max_chars=2000):
             sections.append(remaining_text)
             break
             
-        # try to find natural breaking point (paragraph or sentence)
-        # first look for paragraph breaks
-        split_index = remaining_text[:max_chars].rfind('\n\n')
-        
-        # if no paragraph break, look for sentence break
-        if split_index == -1 or split_index < max_chars * 0.5:
-            # look for last sentence break
-            for punct in ['. ', '! ', '? ']:
-                last_punct = remaining_text[:max_chars].rfind(punct)
-                if last_punct > 0 and (split_index == -1 or last_punct > split_index):
-                    split_index = last_punct + 1  # include punctuation
-            
-        # if no good breaking point found, just split at max_chars
-        if split_index == -1 or split_index < max_chars * 0.5:
-            split_index = max_chars
+        split_index = find_split_index(remaining_text, max_chars)
         
         # add section and update remaining text
         sections.append(remaining_text[:split_index].strip())
@@ -37,6 +28,43 @@ def split_text(text, max_chars=2000):
         
     return sections
 
+def find_split_index(text, max_chars=2000):
+    """find natural index to split text at so first part stays under max_chars"""
+    # try to find natural breaking point (paragraph or sentence)
+    # first look for paragraph breaks
+    split_index = text[:max_chars].rfind('\n\n')
+    
+    # if no paragraph break, look for sentence break
+    if split_index == -1 or split_index < max_chars * 0.5:
+        # look for last sentence break
+        for punct in ['. ', '! ', '? ']:
+            last_punct = text[:max_chars].rfind(punct)
+            if last_punct > 0 and (split_index == -1 or last_punct > split_index):
+                split_index = last_punct + 1  # include punctuation
+        
+    # if no good breaking point found, just split at max_chars
+    if split_index == -1 or split_index < max_chars * 0.5:
+        split_index = max_chars
+    return split_index
+
+def split_sentences(text, max_chars=250, first_max_chars=120):
+    """group text into sentence-sized segments (first one kept short so it can be spoken sooner)"""
+    sentences = [sentence.strip() for sentence in re.split(r'(?<=[.!?])\s+|\n+', text) if sentence.strip()]
+
+    segments = []
+    current = ""
+    for sentence in sentences:
+        limit = first_max_chars if not segments else max_chars
+        # start new segment if sentence doesn't fit (sentences over the limit get a segment of their own)
+        if current and len(current) + len(sentence) + 1 > limit:
+            segments.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        segments.append(current)
+    return segments
+
 def is_url(text):
     """check if input is url and return boolean"""
     url_pattern = re.compile(
@@ -46,4 +74,87 @@ def is_url(text):
         r'[a-zA-Z]{2,}'             # domain suffix
         r'(\/\S*)?$'                # optional trailing path
     )
-    return bool(url_pattern.match(text))
\ No newline at end of file
+    return bool(url_pattern.match(text))
+
+def get_video_id(url):
+    """extract youtube video id from url, or None if url is not a youtube video"""
+    video_id_pattern = re.compile(
+        r'(?:youtube\.com\/(?:watch\?(?:.*&)?v=|shorts\/|embed\/|live\/)'   # youtube.com variants
+        r'|youtu\.be\/)'                                                    # short links
+        r'([A-Za-z0-9_-]{11})'                                               # 11 char video id
+    )
+    match = video_id_pattern.search(url)
+    return match.group(1) if match else None
+
+def get_playlist_id(url):
+    """extract youtube playlist id from playlist url, or None (watch urls inside a playlist play single video)"""
+    if get_video_id(url):
+        return None
+    match = re.search(r'youtube\.com\/playlist\?(?:.*&)?list=([A-Za-z0-9_-]+)', url)
+    return match.group(1) if match else None
+
+def estimate_tokens(text):
+    """rough token count (about 4 chars per token for english)"""
+    return len(text) // 4 + 1
+
+def normalize_text(text):
+    """normalize text for use as cache key (case, punctuation and spacing insensitive)"""
+    text = re.sub(r'[^\w\s]', ' ', text.casefold())
+    return ' '.join(text.split())
+
+def save_json_atomic(path, data):
+    """write data to json file via temp file, so a crash never leaves it half written"""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+class TTLCache:
+    """bounded lru cache whose entries also expire after ttl seconds"""
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()    # key -> (expires_at, value), oldest first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """get value for key, or None if missing or expired"""
+        item = self.entries.get(key)
+        if item is None or item[0] <= time.monotonic():
+            if item is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        
+        # mark as most recently used
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def contains(self, key):
+        """check if key has unexpired value (doesn't count as lookup or refresh recency)"""
+        item = self.entries.get(key)
+        return item is not None and item[0] > time.monotonic()
+
+    def put(self, key, value):
+        """store value for key, evicting least recently used entries over the limit"""
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """remove all entries (counters are kept)"""
+        self.entries.clear()
+
+    def stats(self):
+        """get size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
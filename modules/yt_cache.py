@@ -0,0 +1,101 @@
+# modules/yt_cache.py
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+from modules.utils import save_json_atomic
+
+class ExtractionCache:
+    def __init__(self, max_entries=500, cache_path="cache/yt_extractions.json", expiry_margin=300, default_ttl=3600):
+        self.max_entries = max_entries
+        self.cache_path = cache_path          # set to None to keep cache in memory only
+        self.expiry_margin = expiry_margin    # treat stream urls as expired this many seconds early
+        self.default_ttl = default_ttl        # used when stream url has no expire timestamp
+        self.entries = OrderedDict()          # video_id -> entry, ordered oldest to most recently used
+        self.lock = threading.Lock()          # extraction runs in worker threads
+
+        self.load()
+
+    def get(self, video_id):
+        """get cached extraction for video id if its stream url is still valid"""
+        with self.lock:
+            entry = self.entries.get(video_id)
+            if not entry:
+                return None
+            
+            # stream url expired, drop entry so it gets extracted again
+            if entry["expires_at"] - self.expiry_margin <= time.time():
+                del self.entries[video_id]
+                return None
+            
+            # mark as most recently used
+            self.entries.move_to_end(video_id)
+            return entry
+
+    def put(self, video_id, stream_url, title, duration=None, audio_format=None):
+        """store extraction result for video id and persist to disk"""
+        entry = {
+            "stream_url": stream_url,
+            "title": title,
+            "duration": duration,
+            "format": audio_format or {},
+            "expires_at": self._stream_expiry(stream_url),
+        }
+        with self.lock:
+            self.entries[video_id] = entry
+            self.entries.move_to_end(video_id)
+
+            # evict least recently used entries over the limit
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        
+        self.save()
+        return entry
+
+    def load(self):
+        """load unexpired entries from disk"""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            
+            now = time.time()
+            with self.lock:
+                for video_id, entry in data.items():
+                    if entry.get("expires_at", 0) - self.expiry_margin > now:
+                        self.entries[video_id] = entry
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            print(f"Loaded {len(self.entries)} cached YouTube extractions")
+        except Exception as e:
+            print(f"Error loading YouTube extraction cache: {e}")
+
+    def save(self):
+        """write cache to disk (via temp file so a crash never leaves it half written)"""
+        if not self.cache_path:
+            return
+        try:
+            with self.lock:
+                data = dict(self.entries)
+            save_json_atomic(self.cache_path, data)
+        except Exception as e:
+            print(f"Error saving YouTube extraction cache: {e}")
+
+    def _stream_expiry(self, stream_url):
+        """read expire timestamp embedded in googlevideo stream url"""
+        try:
+            parsed = urlparse(stream_url)
+            expire = parse_qs(parsed.query).get("expire")
+            if expire:
+                return int(expire[0])
+            
+            # some manifest urls carry it as a path segment (/expire/<timestamp>/)
+            parts = parsed.path.split('/')
+            if "expire" in parts:
+                return int(parts[parts.index("expire") + 1])
+        except (ValueError, IndexError):
+            pass
+        return time.time() + self.default_ttl
@@ -1,139 +1,129 @@
 # modules/yt_client.py
-import os
-import yt_dlp
-from pathlib import Path
+import asyncio
+from modules.utils import is_url, get_video_id, normalize_text, TTLCache
+from modules.yt_cache import ExtractionCache
+from modules.yt_pool import YTWorkerPool
 
 class YTClient:
     def __init__(self):
-        # create download directory if nonexistent
-        self.download_dir = "downloads"
-        Path(self.download_dir).mkdir(exist_ok=True)
+        # extraction results keyed by video id, reused until stream url expires
+        self.extraction_cache = ExtractionCache()
 
-    def get_audio_stream(self, url):
+        # normalized search query -> video id, so repeated searches skip youtube search entirely
+        self.search_cache = TTLCache(max_entries=2000, ttl=24 * 3600)
+
+        # worker processes holding warm YoutubeDL instances for search and extraction
+        self.pool = YTWorkerPool()
+
+    async def resolve(self, text):
+        """resolve search term or url to (stream_url, title, duration)"""
+        if is_url(text):
+            return await self.get_audio_stream(text)
+        return await self.search_for_url(text)
+
+    async def get_audio_stream(self, url):
         """extract direct audio stream url from youtube url"""
+        # serve from cache if stream url for this video hasn't expired yet
+        video_id = get_video_id(url)
+        if video_id:
+            cached = self.extraction_cache.get(video_id)
+            if cached:
+                print(f"Extraction cache hit: {cached['title']}")
+                return cached["stream_url"], cached["title"], cached["duration"]
+
         try:
-            # options to extract audio url
-            ydl_options = {
-                'format': 'bestaudio/best',
-                'quiet': False,         # don't hide logging   
-                'noplaylist': True,     # avoid playlists
-                'extract_audio': True,  # extract audio only
-                'skip_download': True,  # don't download, just get info
-            }
+            # extract info in warm worker process
+            info = await self.pool.extract(url)
 
-            with yt_dlp.YoutubeDL(ydl_options) as ydl:
-                # extract info without downloading
-                info_dict = ydl.extract_info(url, download=False)
-                title = info_dict.get('title', 'Unknown Title')
-                
-                # get direct stream url
-                if 'url' in info_dict:
-                    stream_url = info_dict['url']
-                else:
-                    # handle formats list if direct url not available
-                    formats = info_dict.get('formats', [])
-                    if formats:
-                        # get best audio format
-                        audio_formats = [f for f in formats if f.get('acodec') != 'none']
-                        if audio_formats:
-                            stream_url = audio_formats[0]['url']
-                        else:
-                            stream_url = formats[0]['url']
-                    else:
-                        raise Exception("No suitable format found")
+            # cache result under video id (from info, or url if extractor didn't give one)
+            cache_id = info['id'] or video_id
+            if cache_id:
+                await asyncio.to_thread(self.extraction_cache.put, cache_id, info['stream_url'],
+                                        info['title'], info['duration'], info['format'])
                         
-                return stream_url, title
+            return info['stream_url'], info['title'], info['duration']
 
+        except asyncio.TimeoutError:
+            print(f"Timed out extracting stream URL: {url}")
+            return None, "Timed out extracting stream URL", None
         except Exception as e:
             print(f"Error extracting stream URL: {e}")
-            return None, str(e)
+            return None, str(e), None
         
-    def search_for_url(self, search_query):
+    async def search_for_url(self, search_query):
         """search youtube and get stream url for first result"""
         try:
-            # create yt-dlp search query
-            ydl_options = {
-                'quiet': False,         # don't hide logging 
-                'extract_flat': True,   # don't download all videos, just fetch urls
-                'noplaylist': True,     # avoid playlists
-            }
+            # check if same query (ignoring case, spacing, punctuation) was resolved before
+            query_key = normalize_text(search_query)
+            video_id = self.search_cache.get(query_key)
+            if video_id:
+                return await self.get_audio_stream(f"https://www.youtube.com/watch?v={video_id}")
 
-            with yt_dlp.YoutubeDL(ydl_options) as ydl:
-                # search youtube
-                results = ydl.extract_info(f"ytsearch:{search_query}", download=False)
-                
-                if not results.get('entries'):
-                    return None, "No results found for this search query"
-                
-                # get first video from search results
-                first_video = results['entries'][0]
-                video_url = first_video['url'] if 'url' in first_video else first_video['id']
-                
-                # ff we only got the id, create full youtube url
-                if 'youtube.com' not in video_url and 'youtu.be' not in video_url:
-                    video_url = f"https://www.youtube.com/watch?v={video_url}"
-                
-                # get stream url and title
-                stream_url, title = self.get_audio_stream(video_url)
+            # search youtube in warm worker process
+            results = await self.pool.search(search_query)
+            
+            if not results:
+                return None, "No results found for this search query", None
+            
+            # get first video from search results
+            first_video = results[0]
+            video_url = first_video['url'] or first_video['id']
+            
+            # if we only got the id, create full youtube url
+            if 'youtube.com' not in video_url and 'youtu.be' not in video_url:
+                video_url = f"https://www.youtube.com/watch?v={video_url}"
+
+            # remember which video this query resolved to
+            video_id = first_video['id'] or get_video_id(video_url)
+            if video_id:
+                self.search_cache.put(query_key, video_id)
             
-            return stream_url, title
+            # get stream url and title
+            return await self.get_audio_stream(video_url)
             
+        except asyncio.TimeoutError:
+            print(f"Timed out searching YouTube: {search_query}")
+            return None, "Timed out searching YouTube", None
         except Exception as e:
             print(f"Error searching YouTube: {e}")
-            return None, str(e)
+            return None, str(e), None
         
-    def download_from_url(self, url):
-        """legacy method for downloading audio from youtube url"""
-        try:
-            # create yt-dlp options
-            ydl_options = {
-                'format': 'bestaudio/best',
-                'outtmpl': os.path.join(self.download_dir, '%(title)s.%(ext)s'),
-                'quiet': False,         # don't hide logging
-                'noplaylist': True      # avoid playlists
-            }
+    async def playlist_pages(self, url, page_size=100, max_tracks=1000):
+        """yield playlist entries in pages as (video_url, title, duration) tuples, without resolving streams"""
+        start = 1
+        while start <= max_tracks:
+            end = min(start + page_size - 1, max_tracks)
+            try:
+                entries = await self.pool.playlist(url, start, end, timeout=60)
+            except asyncio.TimeoutError:
+                print(f"Timed out listing playlist {url} [{start}-{end}]")
+                return
+            except Exception as e:
+                print(f"Error listing playlist {url}: {e}")
+                return
+            
+            if not entries:
+                return
 
-            with yt_dlp.YoutubeDL(ydl_options) as ydl:
-                # download video and return path
-                info_dict = ydl.extract_info(url, download=True)
-                title = info_dict.get('title', 'Unknown Title')
-                file_path = ydl.prepare_filename(info_dict)
+            page = []
+            for entry in entries:
+                video_url = entry['url'] or entry['id']
+                if not video_url:
+                    continue
+                # if we only got the id, create full youtube url
+                if 'youtube.com' not in video_url and 'youtu.be' not in video_url:
+                    video_url = f"https://www.youtube.com/watch?v={video_url}"
+                page.append((video_url, entry['title'] or video_url, entry['duration']))
+            yield page
 
-            if os.path.exists(file_path):
-                print(f"Downloaded: {title}, path: {file_path}")
-                return file_path, title
-            else:
-                print(f"Warning: File not found at {file_path}")
-                return None, f"File not downloaded correctly: {file_path}"
-    
-        except Exception as e:
-            print(f"Error downloading from YouTube: {e}")
-            return None, str(e)
-    
-    def download_from_search(self, search_query):
-        """search youtube and download first result"""
-        try:
-            # create yt-dlp search query
-            ydl_options = {
-                'quiet': True,          # minimal logging
-                'extract_flat': True,   # don't download all videos, just fetch urls
-                'noplaylist': True,     # avoid playlists
-            }
+            # short page means we reached end of playlist
+            if len(entries) < end - start + 1:
+                return
+            start = end + 1
 
-            with yt_dlp.YoutubeDL(ydl_options) as ydl:
-                # search youtube
-                results = ydl.extract_info(f"ytsearch:{search_query}", download=False)
-                
-                if not results.get('entries'):
-                    return None, "No results found for this search query"
-                
-                # get first video from search results
-                first_video = results['entries'][0]
-                video_url = first_video['url']
-                file_path, title = self.download_from_url(video_url)
-            
-            return file_path, title
-            
-        except Exception as e:
-            print(f"Error searching YouTube: {e}")
-            return None, str(e)
+    def cache_stats(self):
+        """get hit/miss counters of search cache and size of extraction cache"""
+        return {
+            "search": self.search_cache.stats(),
+            "extraction_entries": len(self.extraction_cache.entries),
+        }
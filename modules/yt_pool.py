@@ -0,0 +1,165 @@
+# modules/yt_pool.py
+import asyncio
+import multiprocessing
+import yt_dlp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# options for resolving search terms to video urls
+SEARCH_OPTIONS = {
+    'quiet': True,          # minimal logging (worker output interleaves with bot's)
+    'extract_flat': True,   # don't download all videos, just fetch urls
+    'noplaylist': True,     # avoid playlists
+}
+
+# options to extract audio url
+EXTRACT_OPTIONS = {
+    'format': 'bestaudio/best',
+    'quiet': True,          # minimal logging
+    'noplaylist': True,     # avoid playlists
+    'extract_audio': True,  # extract audio only
+    'skip_download': True,  # don't download, just get info
+}
+
+# options to list playlist entries without extracting each video
+PLAYLIST_OPTIONS = {
+    'quiet': True,                  # minimal logging
+    'extract_flat': 'in_playlist',  # only id/url/title/duration per entry
+    'skip_download': True,          # don't download, just get info
+}
+
+# long-lived YoutubeDL instances, one set per worker process (created by _init_worker)
+_search_ydl = None
+_extract_ydl = None
+_playlist_ydl = None
+
+def _init_worker():
+    """create warm YoutubeDL instances once when worker process starts"""
+    global _search_ydl, _extract_ydl, _playlist_ydl
+    _search_ydl = yt_dlp.YoutubeDL(SEARCH_OPTIONS)
+    _extract_ydl = yt_dlp.YoutubeDL(EXTRACT_OPTIONS)
+    _playlist_ydl = yt_dlp.YoutubeDL(PLAYLIST_OPTIONS)
+
+def _ping():
+    """no-op job used to spin up worker processes ahead of first request"""
+    return True
+
+def _search(query, max_results):
+    """search youtube in worker and return id/url/title of results"""
+    results = _search_ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
+    return [
+        {'id': entry.get('id'), 'url': entry.get('url'), 'title': entry.get('title')}
+        for entry in results.get('entries') or []
+    ]
+
+def _extract(url):
+    """extract info in worker and return only what the bot needs (full info dict is huge to pickle)"""
+    info_dict = _extract_ydl.extract_info(url, download=False)
+
+    # get direct stream url
+    if 'url' in info_dict:
+        chosen_format = info_dict
+    else:
+        # handle formats list if direct url not available
+        formats = info_dict.get('formats', [])
+        if not formats:
+            raise Exception("No suitable format found")
+        
+        # get best audio format
+        audio_formats = [f for f in formats if f.get('acodec') != 'none']
+        chosen_format = audio_formats[0] if audio_formats else formats[0]
+
+    return {
+        'id': info_dict.get('id'),
+        'title': info_dict.get('title', 'Unknown Title'),
+        'duration': info_dict.get('duration'),
+        'stream_url': chosen_format['url'],
+        'format': {
+            'format_id': chosen_format.get('format_id'),
+            'ext': chosen_format.get('ext'),
+            'acodec': chosen_format.get('acodec'),
+            'abr': chosen_format.get('abr'),
+        },
+    }
+
+def _playlist(url, start, end):
+    """list playlist entries start..end (1-based, inclusive) in worker"""
+    # each worker runs one job at a time, so per-call params are safe to set here
+    _playlist_ydl.params['playlist_items'] = f"{start}-{end}"
+    info_dict = _playlist_ydl.extract_info(url, download=False)
+    return [
+        {
+            'id': entry.get('id'),
+            'url': entry.get('url'),
+            'title': entry.get('title'),
+            'duration': entry.get('duration'),
+        }
+        for entry in info_dict.get('entries') or [] if entry
+    ]
+
+class YTWorkerPool:
+    def __init__(self, max_workers=2, timeout=30):
+        self.max_workers = max_workers
+        self.timeout = timeout      # default seconds before a search/extract is abandoned
+        self.executor = self._create_executor()
+
+    def _create_executor(self):
+        # spawn (not fork) so workers don't inherit the bot's sockets and event loop
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+    async def warm_up(self):
+        """start all worker processes so first request doesn't pay process + extractor setup"""
+        await asyncio.gather(*(self._run(_ping) for _ in range(self.max_workers)))
+
+    async def search(self, query, max_results=1, timeout=None):
+        """search youtube, returns list of {'id', 'url', 'title'} dicts"""
+        return await self._run(_search, query, max_results, timeout=timeout)
+
+    async def extract(self, url, timeout=None):
+        """extract stream url, title, duration and chosen format for video url"""
+        return await self._run(_extract, url, timeout=timeout)
+
+    async def playlist(self, url, start, end, timeout=None):
+        """list flat playlist entries start..end, returns list of {'id', 'url', 'title', 'duration'} dicts"""
+        return await self._run(_playlist, url, start, end, timeout=timeout)
+
+    async def _run(self, func, *args, timeout=None, retry=True):
+        """run job in worker process with timeout
+        
+        cancelling the awaiting task drops jobs that haven't started;
+        a timed out job is stuck in its worker, so the pool is recycled to free it
+        """
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            future = loop.run_in_executor(executor, func, *args)
+            return await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            print(f"yt-dlp {func.__name__} timed out, recycling worker pool")
+            self._recycle(executor)
+            raise
+        except BrokenProcessPool:
+            # worker died (or pool was recycled under this job), retry once on fresh pool
+            self._recycle(executor)
+            if not retry:
+                raise
+            return await self._run(func, *args, timeout=timeout, retry=False)
+
+    def _recycle(self, executor):
+        """replace executor with fresh pool and kill its workers (no-op if already replaced)"""
+        if executor is not self.executor:
+            return
+        self.executor = self._create_executor()
+
+        # executor has no public way to stop running jobs before python 3.14
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        """stop worker processes without waiting for running jobs"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -5,6 +5,8 @@ import threading
 import signal
 import sys
 import random
+import re
+from io import BytesIO
 from dotenv import load_dotenv
 
 import discord
@@ -17,7 +19,9 @@ from modules.crypto_client import CryptoClient
 from modules.yt_client import YTClient
 from modules.audio_player import AudioPlayer
 from modules.persona import Persona
-from modules.utils import is_url, split_text
+from modules.conversation import ConversationStore
+from modules.scheduler import BackendScheduler, SchedulerOverloaded
+from modules.utils import split_sentences, find_split_index, get_playlist_id
 
 # unused error message: "De Zulu can track de great wildebeest, but (...)"
 
@@ -41,12 +45,28 @@ class ZuluBot:
         self.tts = TTSClient()
         self.crypto = CryptoClient()
         self.yt_client = YTClient()
-        self.audio_player = AudioPlayer()
         # self.speech_processor = SpeechProcessor()
         self.persona = Persona()
+
+        # per-channel chat history, older turns compacted into summary to keep prompts small
+        self.conversations = ConversationStore(self.llm)
+
+        # fair-share queues in front of each backend so one user can't hog api quotas
+        self.schedulers = {
+            "gemini": BackendScheduler("gemini", max_concurrency=8, rate=1.0, burst=10),
+            "elevenlabs": BackendScheduler("elevenlabs", max_concurrency=3, rate=0.5, burst=5),
+            "coinmarketcap": BackendScheduler("coinmarketcap", max_concurrency=4, rate=0.5, burst=5),
+            "youtube": BackendScheduler("youtube", max_concurrency=4, rate=2.0, burst=10),
+        }
+
+        # audio players keyed by guild id (created lazily, released when idle)
+        self.audio_players = {}
         
         # control flags
         self.stop_event = threading.Event()
+
+        # in-flight backend calls keyed by id of command message (cancelled if message is deleted)
+        self.pending_commands = {}
         
         # setup signal handlers
         signal.signal(signal.SIGINT, self.signal_handler)
@@ -59,6 +79,13 @@ class ZuluBot:
             "De wisdom of de Zulu is clouded. Try agen soon.",
         ]
 
+        # messages for requests rejected because a backend is overloaded
+        self.busy_messages = [
+            "Too many warriors speak at once! De Zulu cannot hear yu. Try agen soon.",
+            "De Zulu is fighting many battles. Wait yoh turn, warrior.",
+            "De spirits ah too busy for yu right now. Try agen soon.",
+        ]
+
         # discord text char limit
         self.max_chars = 2000
     
@@ -67,6 +94,18 @@ class ZuluBot:
         @self.bot.event
         async def on_ready():
             print(f'Logged in as {self.bot.user}!')
+            # start yt-dlp workers before anyone asks for music
+            await self.yt_client.pool.warm_up()
+            # start background refresh of local coin data
+            self.crypto.alert_callback = self.notify_price_alerts
+            self.crypto.start()
+
+        @self.bot.event
+        async def on_message_delete(message):
+            # user abandoned command, stop waiting on its backend call
+            task = self.pending_commands.get(message.id)
+            if task:
+                task.cancel()
         
         @self.bot.command()
         async def zulusummon(ctx, suppress_messages=False):
@@ -116,6 +155,22 @@ class ZuluBot:
         async def zulustop(ctx):
             await self.handle_stop(ctx)
 
+        @self.bot.command()
+        async def zulumove(ctx, from_position: int = 0, to_position: int = 0):
+            await self.handle_move(ctx, from_position, to_position)
+
+        @self.bot.command()
+        async def zuluremove(ctx, position: int = 0):
+            await self.handle_remove(ctx, position)
+
+        @self.bot.command()
+        async def zulushuffle(ctx):
+            await self.handle_shuffle(ctx)
+
+        @self.bot.command()
+        async def zuluclear(ctx):
+            await self.handle_clear(ctx)
+
         @self.bot.command()
         async def zulusetpersona(ctx, *, text=""):
             await self.handle_set_persona(ctx, text)
@@ -180,9 +235,15 @@ class ZuluBot:
         self.stop_event.set()
 
         if ctx.voice_client:
+            # drop this server's queue so nothing resumes after disconnect
+            player = self.audio_players.get(ctx.guild.id)
+            if player:
+                player.clear_queue()
+
             if ctx.voice_client.is_playing():
                 ctx.voice_client.stop()
             await ctx.voice_client.disconnect()
+            self.release_audio_player(ctx.guild.id)
             await ctx.send("De Zulu is gon.")
             print("Zulu disconnected from voice channel.")
         else:
@@ -195,30 +256,37 @@ class ZuluBot:
             await ctx.send("Speak tu me, warrior! Yu must provide de text.")
             return
         
-        # get llm response
-        llm_response = await asyncio.to_thread(self.llm.generate_response, text, self.persona.context, self.error_messages)
+        # inform user that zulu is processing
+        processing_msg = await ctx.send("De Zulu is tinking very hard...")
+
+        # stream llm response into processing message as it is generated
+        history = self.conversations.get_history(ctx.channel.id)
+        chunks = self.llm.stream_response(text, self.persona.context, self.error_messages,
+                                          use_cache=self.persona.cache_responses, history=history)
+        respond = lambda: self.stream_text_response(ctx, processing_msg, chunks)
+
+        # cached answers need no model call, so only misses wait for their turn with gemini
+        if self.persona.cache_responses and self.llm.is_cached(text, self.persona.context, history):
+            llm_response = await respond()
+        else:
+            llm_response = await self.run_cancellable(ctx, self.run_scheduled(ctx, "gemini", respond, processing_msg))
+        if llm_response is None:
+            return
+
+        # remember exchange for follow-up questions in this channel (error replies aren't worth remembering)
+        if llm_response not in self.error_messages:
+            self.conversations.add_exchange(ctx.channel.id, ctx.author.display_name, text, self.persona.name, llm_response)
         
         # connect to voice channel with suppressed messages
         is_summoned = await self.handle_summon(ctx, suppress_messages=True)
 
-        # inform user that zulu is processing
-        processing_msg = await ctx.send("De Zulu is tinking very hard...")
-
         if is_summoned:
-            # send to audio processing pipeline with text callback (for syncing audio+text if queued)
-            message = await self.process_text(ctx, llm_response, "Zuluask", 
-                                            text_callback=lambda: self.send_text_response(ctx, llm_response))
+            # text is already in chat, send answer to audio processing pipeline
+            message = await self.process_text(ctx, llm_response, "Zuluask")
             if message: 
-                if message: 
-                    # response will be 'now playing' or error message
-                    await processing_msg.edit(content=message)
-                    print("Zuluask txt:", text)
-        else:
-            # remove processing messsage
-            await processing_msg.delete()
-
-            # send response in text chat too
-            await self.send_text_response(ctx, llm_response)
+                # response will be 'now playing' or error message
+                await ctx.send(message)
+                print("Zuluask txt:", text)
 
     async def handle_say(self, ctx, text):
         """narrate user message in voice chat"""
@@ -255,26 +323,36 @@ class ZuluBot:
         processing_msg = await ctx.send("De Zulu is crafting de mastahpiece...")
 
         # generate image using llm
-        llm_response = await asyncio.to_thread(self.llm.generate_image, text, self.persona.context, self.error_messages)
+        draw = lambda: self.llm.generate_image(text, self.persona.context, self.error_messages)
+        if self.llm.is_image_cached(text, self.persona.context):
+            # repeat prompts are served from memory without waiting for gemini
+            llm_response = await draw()
+        else:
+            # image generation is heavier, counts as several requests in fair share
+            llm_response = await self.run_cancellable(ctx, self.run_scheduled(
+                ctx, "gemini", draw, processing_msg, cost=4.0))
+        if llm_response is None:
+            return
 
         if llm_response:
-            # result is a tuple of (text_response, image_path) or error_message string
+            # result is a tuple of (text_response, image_bytes, extension) or error_message string
             if isinstance(llm_response, tuple):
-                text_response, image_path = llm_response
+                text_response, image_data, extension = llm_response
                 
                 # send text response if available
                 if text_response:
                     await ctx.send(text_response)
                 
                 # send image if available
-                if image_path and os.path.exists(image_path):
+                if image_data:
                     try:
-                        with open(image_path, 'rb') as f:
-                            picture = discord.File(f, filename="zulu_creation.png")
-                            await ctx.send(file=picture)
-                        
-                        # clean up the temporary file
-                        os.remove(image_path)
+                        # only re-encode (off event loop) if discord can't take image as it is
+                        upload_limit = ctx.guild.filesize_limit if ctx.guild else 10 * 1024 * 1024
+                        if extension is None or len(image_data) > upload_limit:
+                            image_data, extension = await asyncio.to_thread(self.llm.fit_image, image_data, upload_limit)
+
+                        picture = discord.File(BytesIO(image_data), filename=f"zulu_creation.{extension}")
+                        await ctx.send(file=picture)
                         
                     except Exception as e:
                         print(f"Error sending image: {e}")
@@ -319,60 +397,155 @@ class ZuluBot:
             # let user know we're processing
             processing_msg = await ctx.send("De Zulu is searching for de track...")
 
-            if is_url(text):
-                stream_url, title = await asyncio.to_thread(self.yt_client.get_audio_stream, text)
+            # player is looked up once scheduler grants turn (it may have been released while waiting)
+            if get_playlist_id(text):
+                # list playlist in pages, each track's stream is only resolved shortly before it plays
+                message = await self.run_scheduled(ctx, "youtube", lambda: self.get_audio_player(ctx.guild.id).enqueue_playlist(
+                    ctx, self.yt_client.playlist_pages(text)), processing_msg)
             else:
-                stream_url, title = await asyncio.to_thread(self.yt_client.search_for_url, text)
-
-            # if stream url not found
-            if not stream_url:
-                await processing_msg.edit(content="De Zulu cannot find dis track. It is probably age-restricted and yu ah but a bebeh. Zulu will fix anodda time")
-                return
-            
-            # play stream and get resulting message
-            message = await self.audio_player.play(ctx, stream_url, title, True)
+                # queue track right away if something is playing (resolved in background), else play it now
+                message = await self.run_scheduled(
+                    ctx, "youtube", lambda: self.get_audio_player(ctx.guild.id).enqueue(ctx, text), processing_msg)
 
             # update message
-            await processing_msg.edit(content=message)
+            if message:
+                await processing_msg.edit(content=message)
         else:
             await ctx.send("De Zulu is not in de voice channel.")
 
     async def handle_pause(self, ctx):
         """pause current playback"""
-        message = await self.audio_player.pause(ctx.voice_client)
+        player = self.audio_players.get(ctx.guild.id)
+        if not player:
+            await ctx.send("How can de Zulu pause when notting is playing?")
+            return
+        message = await player.pause(ctx.voice_client)
         await ctx.send(message)
 
     async def handle_resume(self, ctx): 
         """resume current playback"""
-        message = await self.audio_player.resume(ctx.voice_client)
+        player = self.audio_players.get(ctx.guild.id)
+        if not player:
+            await ctx.send("How can de Zulu resume when notting is playing?")
+            return
+        message = await player.resume(ctx.voice_client)
         await ctx.send(message)
 
     async def handle_skip(self, ctx): 
         """skip current playback in queue"""
-        message = await self.audio_player.skip(ctx.voice_client)
+        player = self.audio_players.get(ctx.guild.id)
+        if not player:
+            await ctx.send("How can de Zulu skip de current track when notting is playing and de queue is empty?")
+            return
+        message = await player.skip(ctx)
         await ctx.send(message)
 
     async def handle_queue(self, ctx): 
         """display current queue"""
-        message = await self.audio_player.get_queue()
+        player = self.audio_players.get(ctx.guild.id)
+        if not player:
+            await ctx.send("Der are no tracks in de queue.")
+            return
+        message = await player.get_queue()
         await ctx.send(message)
 
     async def handle_stop(self, ctx):
         """stop current playback"""
-        message = await self.audio_player.stop(ctx.voice_client)
+        player = self.audio_players.get(ctx.guild.id)
+        if not player:
+            await ctx.send("How can de Zulu stop when notting is playing?")
+            return
+        message = await player.stop(ctx.voice_client)
         await ctx.send(message)
 
+    async def handle_move(self, ctx, from_position, to_position):
+        """move track to different position in queue"""
+        player = self.audio_players.get(ctx.guild.id)
+        if not player or not player.queue:
+            await ctx.send("Der are no tracks in de queue.")
+            return
+        await ctx.send(player.move(from_position, to_position))
+
+    async def handle_remove(self, ctx, position):
+        """remove track from queue"""
+        player = self.audio_players.get(ctx.guild.id)
+        if not player or not player.queue:
+            await ctx.send("Der are no tracks in de queue.")
+            return
+        await ctx.send(player.remove(position))
+
+    async def handle_shuffle(self, ctx):
+        """shuffle queue"""
+        player = self.audio_players.get(ctx.guild.id)
+        if not player or not player.queue:
+            await ctx.send("Der are no tracks in de queue.")
+            return
+        await ctx.send(player.shuffle())
+
+    async def handle_clear(self, ctx):
+        """remove all of user's tracks from queue"""
+        player = self.audio_players.get(ctx.guild.id)
+        if not player or not player.queue:
+            await ctx.send("Der are no tracks in de queue.")
+            return
+        await ctx.send(player.clear_by_user(ctx.author.id))
+
     async def handle_crypto(self, ctx, text):
         """fetch crypto data from coinmarketcap"""
-        async with ctx.typing():
-            if not text:
-                # if user doesn't specify coin, get top coins
-                crypto_data = await asyncio.to_thread(self.crypto.fetch_top_coins)
-            else:
-                # get user specified coin
-                crypto_data = await asyncio.to_thread(self.crypto.fetch_coin_data, text)
+        # alert subcommands are served from memory
+        if text.lower() == "alerts" or text.lower().startswith("alert "):
+            await self.handle_crypto_alert(ctx, text)
+            return
+
+        # if user doesn't specify coin, get top coins, else get user specified coin
+        fetch = (lambda: self.crypto.fetch_coin_data(text)) if text else self.crypto.fetch_top_coins
+
+        # answers from market snapshot need no api calls, so only live lookups are queued
+        if self.crypto.is_cached(text):
+            crypto_data = await fetch()
+        else:
+            async with ctx.typing():
+                crypto_data = await self.run_scheduled(ctx, "coinmarketcap", fetch)
             
-            await ctx.send(embed=crypto_data)
+        if crypto_data:
+            embed, chart_file = crypto_data
+            await ctx.send(embed=embed, file=chart_file)
+
+    async def handle_crypto_alert(self, ctx, text):
+        """create, list or remove price alerts"""
+        # alerts made in direct messages are kept under no guild
+        guild_id = ctx.guild.id if ctx.guild else None
+        if text.lower() == "alerts":
+            await ctx.send(embed=self.crypto.create_alerts_embed(guild_id, ctx.author.id))
+            return
+
+        remove_match = re.match(r'^alert\s+remove\s+#?(\d+)$', text, re.IGNORECASE)
+        if remove_match:
+            await ctx.send(embed=self.crypto.remove_alert(int(remove_match.group(1)), ctx.author.id))
+            return
+
+        alert_match = re.match(r'^alert\s+(.+?)\s+(above|below)\s+\$?([\d,]*\.?\d+)$', text, re.IGNORECASE)
+        if not alert_match:
+            await ctx.send("De Zulu does not understand. Use **!zulucrypto alert *<coin>* above|below *<price>* **")
+            return
+
+        coin, direction, threshold = alert_match.groups()
+        await ctx.send(embed=self.crypto.create_alert(coin, direction.lower(), float(threshold.replace(',', '')),
+            guild_id, ctx.channel.id, ctx.author.id))
+
+    async def notify_price_alerts(self, alerts, prices):
+        """ping users whose price alerts were triggered"""
+        for alert in alerts:
+            try:
+                channel = self.bot.get_channel(alert.channel_id)
+                if not channel:
+                    continue
+                await channel.send(f"<@{alert.user_id}> De spirits have spoken! {alert.name} ({alert.symbol}) has gone "
+                    f"{alert.direction} {self.crypto.format_price(alert.threshold)}. "
+                    f"It is now {self.crypto.format_price(prices[alert.coin_id])}.")
+            except Exception as e:
+                # one failed notification must not stop the rest
+                print(f"Error sending price alert {alert.alert_id}: {e}")
 
     async def handle_help(self, ctx):
         """display list of commands"""
@@ -384,14 +557,21 @@ class ZuluBot:
             "**!zulusay *<text>* ** - Narrate yoh text in de voice channel\n"
             "**!zulusetpersona <name>** - Set Zulubot's persona\n"
             "**!zulupersonas** - Display de list of available personas\n"
-            "**!zuluplay *<youtube_url* || *search_query>* ** - Play de music from youtube \n"
+            "**!zuluplay *<youtube_url* || *playlist_url* || *search_query>* ** - Play de music from youtube \n"
             "**!zulupause** - Pause de current playback\n"
             "**!zuluresume** - Resume de current playback\n"
             "**!zuluskip** - Skip current de playback and play de next in queue\n"
             "**!zuluqueue** - Display de current queue\n"
             "**!zulustop** - Stop de current playback and clear de queue\n"
+            "**!zulumove *<from>* *<to>* ** - Move de track to anodda position in de queue\n"
+            "**!zuluremove *<position>* ** - Remove de track from de queue\n"
+            "**!zulushuffle** - Shuffle de queue\n"
+            "**!zuluclear** - Remove all yoh tracks from de queue\n"
             "**!zulucrypto** - Get de crypto data for de top coins\n"
             "**!zulucrypto *<coin_name>* ** - Get de crypto data for de specified coin\n"
+            "**!zulucrypto alert *<coin>* above|below *<price>* ** - Get pinged when de coin crosses de price\n"
+            "**!zulucrypto alerts** - Display yoh price alerts\n"
+            "**!zulucrypto alert remove *<id>* ** - Remove de price alert\n"
             "**!zuluhelp** - Display dis help message\n"
         )
         async with ctx.typing():
@@ -418,36 +598,153 @@ class ZuluBot:
     #             await ctx.voice_client.disconnect()
     #             await ctx.send("De Zulu is gon.")
 
-    async def process_text(self, ctx, text, type, text_callback=None):
-        """process text through tts pipeline"""
+    async def process_text(self, ctx, text, type):
+        """process text through tts pipeline (queued fairly with other users' speech)
+        
+        reply is returned as soon as speech is playing or queued, while the scheduler slot
+        stays held until all of it has been synthesized
+        """
+        reply = asyncio.get_running_loop().create_future()
+
+        async def speak():
+            message, sources = await self._speak_text(ctx, text, type)
+            reply.set_result(message)
+            await self.tts.wait_synthesized(sources)
+
+        task = asyncio.create_task(self.schedulers["elevenlabs"].submit(ctx.guild.id, ctx.author.id, speak))
+        await asyncio.wait({task, reply}, return_when=asyncio.FIRST_COMPLETED)
+        if reply.done():
+            return reply.result()
+        try:
+            task.result()
+        except SchedulerOverloaded:
+            return random.choice(self.busy_messages)
+        except Exception as e:
+            print(f"Error in processing pipeline: {e}")
+        return random.choice(self.error_messages)
+
+    async def _speak_text(self, ctx, text, type):
+        """synthesize text and hand it to guild's audio player, returns (reply, speech still streaming in)"""
         try:
-            # convert llm response to speech
-            tts_path = await self.tts.generate_speech(text, self.persona.voice_id)
+            audio_name = f"{type} message [Persona: {self.persona.name}]"
+
+            # long answers are spoken sentence by sentence, synthesized in parallel so speech starts sooner
+            segments = split_sentences(text)
+            if len(segments) > 1:
+                player = self.get_audio_player(ctx.guild.id)
+                sources = self.tts.synthesize_segments(segments, self.persona.voice_id)
+                return await player.enqueue_speech(ctx, audio_name, sources), sources
+
+            # convert llm response to speech, streamed in memory so playback starts on first chunk
+            # (or path of cached clip if this text was already spoken in persona's voice)
+            tts_stream = await self.tts.stream_speech(text, self.persona.voice_id)
 
             # play speech in voice channel
-            if tts_path:
-                audio_name = f"{type} message [Persona: {self.persona.name}]"
-                message = await self.audio_player.play(ctx, tts_path, audio_name, False, text_callback)
-                return message
+            if tts_stream:
+                player = self.get_audio_player(ctx.guild.id)
+                message = await player.play(ctx, tts_stream, audio_name, False)
+                return message, [tts_stream]
             # if tts fails to generate
             else:
-                return "De Zulu has lost his tongue."
+                return "De Zulu has lost his tongue.", []
                 
         except Exception as e:
             print(f"Error in processing pipeline: {e}")
-            return random.choice(self.error_messages)
-    
-    async def send_text_response(self, ctx, llm_response):
-        """send text response to chat"""
-        # in case response is too long, send each section as seperate message
-        response_sections = split_text(llm_response, max_chars=self.max_chars)
-        for section in response_sections:
-            await ctx.send(section)
+            return random.choice(self.error_messages), []
     
+    async def run_scheduled(self, ctx, backend, coro_factory, processing_msg=None, cost=1.0):
+        """run backend call through its fair-share scheduler
+        
+        if backend is overloaded the user is told so (in processing_msg if given) and None is returned
+        """
+        guild_id = ctx.guild.id if ctx.guild else None
+        try:
+            return await self.schedulers[backend].submit(guild_id, ctx.author.id, coro_factory, cost)
+        except SchedulerOverloaded:
+            print(f"Rejected {backend} request from {ctx.author}: overloaded")
+            message = random.choice(self.busy_messages)
+            if processing_msg:
+                await processing_msg.edit(content=message)
+            else:
+                await ctx.send(message)
+            return None
+
+    async def run_cancellable(self, ctx, coro):
+        """run backend call as task that is cancelled if command message gets deleted, returns None if cancelled"""
+        task = asyncio.create_task(coro)
+        self.pending_commands[ctx.message.id] = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            # only swallow cancellation of backend call, not of command itself
+            if not task.cancelled():
+                raise
+            print(f"Command abandoned: {ctx.message.content}")
+            return None
+        finally:
+            self.pending_commands.pop(ctx.message.id, None)
+
+    def get_audio_player(self, guild_id):
+        """get audio player for guild, creating it if nonexistent"""
+        player = self.audio_players.get(guild_id)
+        if player is None:
+            player = AudioPlayer(server_id=guild_id, on_idle=self.release_audio_player,
+                                 resolver=self.yt_client.resolve, clip_cache=self.tts.clip_cache)
+            self.audio_players[guild_id] = player
+        return player
+
+    def release_audio_player(self, guild_id):
+        """remove guild's audio player from registry once it has nothing to do"""
+        player = self.audio_players.get(guild_id)
+        if player and player.is_idle():
+            del self.audio_players[guild_id]
+
+    async def stream_text_response(self, ctx, message, chunks, edit_interval=1.0):
+        """progressively edit message with streamed text, rolling over to new messages at max_chars
+        
+        edits are throttled to edit_interval seconds (discord rate limits message edits), returns full text
+        """
+        loop = asyncio.get_running_loop()
+        full_text = ""
+        pending = ""        # text shown in current message
+        last_edit = 0.0
+        
+        async for chunk in chunks:
+            full_text += chunk
+            pending += chunk
+
+            # current message is full, finalize it at natural break and continue in new message
+            while len(pending) > self.max_chars:
+                split_index = find_split_index(pending, self.max_chars)
+                if message:
+                    await message.edit(content=pending[:split_index].strip())
+                else:
+                    await ctx.send(pending[:split_index].strip())
+                pending = pending[split_index:].lstrip()
+                # next message is only opened once there is text to put in it
+                message = None
+                last_edit = loop.time()
+            
+            if not pending.strip():
+                continue
+            if message is None:
+                message = await ctx.send(pending)
+                last_edit = loop.time()
+            elif loop.time() - last_edit >= edit_interval:
+                await message.edit(content=pending)
+                last_edit = loop.time()
+        
+        # final edit with complete text
+        if pending.strip() and message:
+            await message.edit(content=pending)
+        return full_text
+
     # signal handler for graceful shutdown (ctrol+c)
     def signal_handler(self, sig, frame):
         print("\nGracefully shutting down...")
         self.stop_event.set()
+        self.yt_client.pool.shutdown()
+        asyncio.run_coroutine_threadsafe(self.crypto.close(), self.bot.loop)
         asyncio.run_coroutine_threadsafe(self.bot.close(), self.bot.loop)
         print("Cleanup complete. Exiting.")
         sys.exit(0)